@@ -0,0 +1,260 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+"""
+Measures the bot's hot paths on a reproducible synthetic corpus.
+
+i.e:
+python -m benchmarks.benchmark --messages 20000 --config gamerbot.cfg
+python -m benchmarks.benchmark --no-db --phrases "gamer,gamers in chat" --json results.json
+
+Database benchmarks start a full GamerBot, which migrates the schema and stores the phrases, so they only run against
+the scratch database named by [Benchmark] scratch_database, never the bot's own database. Ingestion itself runs inside a
+single transaction that is rolled back at the end.
+"""
+
+import argparse
+import configparser
+import json
+import math
+import resource
+import sys
+import time
+
+from sigmod_fingerprinting.fingerprint import Fingerprint
+
+from gamerbot.database import DatabasePool
+from gamerbot.database.conditionals import Eq
+from gamerbot.database.tables import CHANNEL_PHRASE_COUNTS, GUILD_PHRASE_COUNTS
+from gamerbot.gamerbot import GamerBot
+from gamerbot.util.fingerprint import fingerprints_to_hashes, template_match_hashes
+from gamerbot.util.matcher import PhraseMatcher
+
+from .corpus import CorpusConfig, generate_corpus
+
+
+class BenchmarkResult(object):
+    def __init__(self, name, messages, latencies):
+        """
+        :param name: Name of the benchmarked path.
+        :param messages: Number of messages processed.
+        :param latencies: Array of seconds taken per call.
+        """
+        self.name = name
+        self.messages = messages
+        self.total = sum(latencies)
+        self.latencies = sorted(latencies)
+
+    def percentile(self, percent):
+        if len(self.latencies) == 0:
+            return 0.0
+
+        return self.latencies[max(0, int(math.ceil(percent / 100 * len(self.latencies))) - 1)]
+
+    def messages_per_second(self):
+        return self.messages / self.total if self.total > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'messages': self.messages,
+            'calls': len(self.latencies),
+            'seconds': self.total,
+            'messages_per_second': self.messages_per_second(),
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000
+        }
+
+    def __str__(self):
+        return "{:<24} {:>8} {:>10.3f} {:>12.1f} {:>10.3f} {:>10.3f}".format(
+            self.name, self.messages, self.total, self.messages_per_second(), self.percentile(50) * 1000,
+            self.percentile(99) * 1000)
+
+
+def measure(name, calls):
+    """
+    Times every call separately.
+
+    :param calls: Array of (number of messages, callable).
+    """
+    latencies = []
+    messages = 0
+
+    for count, call in calls:
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+
+        messages += count
+
+    return BenchmarkResult(name, messages, latencies)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def benchmark_matching(matcher, match, messages, batch_size):
+    results = [
+        measure("match", [(1, lambda m=m: match(m.content)) for m in messages]),
+        measure("match_many", [(len(b), lambda b=b: matcher.match_many([m.content for m in b]))
+                               for b in _batches(messages, batch_size)])
+    ]
+
+    # fingerprinting is left out of the timings, only the template search itself is measured
+    calls = []
+    for message in messages:
+        searches = []
+
+        for fingerprinter, templates in matcher.template_groups.values():
+            try:
+                source_hashes = fingerprints_to_hashes(fingerprinter.generate(message.content.lower()))
+            except:
+                continue
+
+            for _, template_fingerprints in templates:
+                searches.append((fingerprints_to_hashes(template_fingerprints), source_hashes))
+
+        def search(searches=searches):
+            for template_hashes, source_hashes in searches:
+                template_match_hashes(template_hashes, source_hashes, matcher.match_percent)
+
+        calls.append((1, search))
+
+    results.append(measure("template_match_hashes", calls))
+
+    return results
+
+
+def benchmark_database(bot, guilds, messages, batch_size, stats_iterations):
+    results = []
+
+    with bot.db_pool.database() as db:
+        try:
+            for guild in guilds:
+                bot._ingest_guild(db, guild)
+                bot._ingest_users(db, guild.members)
+                bot._ingest_channels(db, guild.text_channels)
+
+            half = len(messages) // 2
+
+            # ids resolved inside the transaction stay valid until it's rolled back, cache them like a commit would
+            def ingest(call, *args):
+                content_ids = {}
+                call(db, *args, content_ids)
+                bot.content_id_cache.update(content_ids)
+
+            results.append(measure("ingest_message", [(1, lambda m=m: ingest(bot._ingest_message, m)) for m in messages[:half]]))
+            results.append(measure("ingest_messages", [(len(b), lambda b=b: ingest(bot._ingest_messages, b))
+                                                       for b in _batches(messages[half:], batch_size)]))
+
+            calls = []
+            for _ in range(stats_iterations):
+                for guild in guilds:
+                    calls.append((1, lambda g=guild: bot._get_leaderboard(db, GUILD_PHRASE_COUNTS, Eq(GUILD_PHRASE_COUNTS.GUILD_ID, g.id), user_limit=3)))
+
+                    for channel in guild.text_channels:
+                        calls.append((1, lambda c=channel: bot._get_leaderboard(db, CHANNEL_PHRASE_COUNTS, Eq(CHANNEL_PHRASE_COUNTS.CHANNEL_ID, c.id), user_limit=3)))
+
+            results.append(measure("stats_leaderboard", calls))
+        finally:
+            db.rollback()
+
+            bot.content_id_cache.clear()
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks matching and ingestion throughput on a synthetic corpus.")
+    parser.add_argument("--config", default="gamerbot.cfg", help="Bot config, used for the scratch database and phrases.")
+    parser.add_argument("--no-db", action="store_true", help="Only run the benchmarks that don't need Postgres.")
+    parser.add_argument("--phrases", help="Comma separated phrases, defaults to the config's phrases.")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--channels-per-guild", type=int, default=5)
+    parser.add_argument("--users-per-guild", type=int, default=50)
+    parser.add_argument("--mean-words", type=float, default=8.0, help="Median words per message.")
+    parser.add_argument("--words-sigma", type=float, default=0.8, help="Sigma of the log-normal message length.")
+    parser.add_argument("--phrase-density", type=float, default=0.1, help="Share of messages containing a phrase.")
+    parser.add_argument("--copypasta-rate", type=float, default=0.05, help="Share of messages repeating a copypasta.")
+    parser.add_argument("--copypastas", type=int, default=20, help="Number of distinct copypastas.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Messages per batched call.")
+    parser.add_argument("--stats-iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    if args.phrases is not None:
+        phrases = args.phrases.split(',')
+    else:
+        phrases = config.get("Gamerbot", "phrases", fallback="gamer,gamers in chat").split(',')
+
+    corpus_config = CorpusConfig(messages=args.messages, guilds=args.guilds, channels_per_guild=args.channels_per_guild,
+                                 users_per_guild=args.users_per_guild, mean_words=args.mean_words,
+                                 words_sigma=args.words_sigma, phrase_density=args.phrase_density,
+                                 copypasta_rate=args.copypasta_rate, copypastas=args.copypastas, seed=args.seed)
+
+    guilds, messages = generate_corpus(corpus_config, phrases)
+
+    bot = None
+    if not args.no_db:
+        scratch_database = config.get("Benchmark", "scratch_database", fallback="").strip()
+
+        if len(scratch_database) == 0:
+            parser.error("Set [Benchmark] scratch_database to a disposable database, or pass --no-db.")
+
+        if scratch_database == config.get("PostgreSQL", "database", fallback=None):
+            parser.error("[Benchmark] scratch_database can't be the bot's own database.")
+
+        db_pool = DatabasePool(1, 1,
+                               user=config.get("PostgreSQL", "db_user"),
+                               password=config.get("PostgreSQL", "db_password"),
+                               host=config.get("PostgreSQL", "host"),
+                               port=config.get("PostgreSQL", "port"),
+                               database=scratch_database)
+
+        bot = GamerBot(db_pool, phrases, config)
+
+    try:
+        if bot is not None:
+            matcher = bot.phrase_matcher
+            match = bot._get_matched_phrase_ids
+        else:
+            matcher = PhraseMatcher(dict(enumerate(phrases)), Fingerprint())
+            match = matcher.match
+
+        results = benchmark_matching(matcher, match, messages, args.batch_size)
+
+        if bot is not None:
+            results += benchmark_database(bot, guilds, messages, args.batch_size, args.stats_iterations)
+    finally:
+        if bot is not None:
+            bot.db_pool.close()
+
+    print("{:<24} {:>8} {:>10} {:>12} {:>10} {:>10}".format("benchmark", "messages", "seconds", "messages/s", "p50 ms", "p99 ms"))
+    for result in results:
+        print(result)
+    print("peak RSS: {:.1f} MB".format(peak_rss_mb()))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({'corpus': vars(corpus_config), 'peak_rss_mb': peak_rss_mb(),
+                       'results': [result.to_dict() for result in results]}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import datetime
+import random
+import string
+
+import discord
+
+DISCORD_EPOCH = 1420070400000
+
+MAX_MESSAGE_LENGTH = 2000
+
+
+class StandInUser(object):
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.mention = "<@{}>".format(id)
+
+
+class StandInGuild(object):
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.members = []
+        self.text_channels = []
+
+
+class StandInTextChannel(discord.TextChannel):
+    """
+    Passes the bot's isinstance(channel, discord.TextChannel) checks without a connection state behind it.
+    """
+    def __init__(self, id, name, guild):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.last_message_id = None
+
+
+class StandInMessage(object):
+    def __init__(self, id, content, author, channel):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.created_at = datetime.datetime.utcfromtimestamp(((id >> 22) + DISCORD_EPOCH) / 1000)
+        self.raw_mentions = []
+        self.webhook_id = None
+
+
+class CorpusConfig(object):
+    """
+    Shape of a synthetic corpus, every value has a command line counterpart in benchmarks.benchmark.
+    """
+    def __init__(self, messages=10000, guilds=2, channels_per_guild=5, users_per_guild=50, mean_words=8.0,
+                 words_sigma=0.8, phrase_density=0.1, copypasta_rate=0.05, copypastas=20, vocabulary=5000, seed=0):
+        """
+        :param messages: Number of messages to generate.
+        :param guilds: Number of guilds the messages are spread over.
+        :param channels_per_guild: Number of text channels per guild.
+        :param users_per_guild: Number of members per guild.
+        :param mean_words: Median number of words per message, lengths are log-normally distributed.
+        :param words_sigma: Sigma of the log-normal message length distribution.
+        :param phrase_density: Probability of a message containing one of the tracked phrases.
+        :param copypasta_rate: Probability of a message repeating one of the copypastas verbatim.
+        :param copypastas: Number of distinct copypastas.
+        :param vocabulary: Number of distinct filler words.
+        :param seed: Random seed, the same config and seed always generate the same corpus.
+        """
+        self.messages = messages
+        self.guilds = guilds
+        self.channels_per_guild = channels_per_guild
+        self.users_per_guild = users_per_guild
+        self.mean_words = mean_words
+        self.words_sigma = words_sigma
+        self.phrase_density = phrase_density
+        self.copypasta_rate = copypasta_rate
+        self.copypastas = copypastas
+        self.vocabulary = vocabulary
+        self.seed = seed
+
+
+def _snowflake(timestamp_ms, sequence):
+    return ((timestamp_ms - DISCORD_EPOCH) << 22) | (sequence & 0x3FFFFF)
+
+
+def _random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+
+
+def _random_text(rng, words, config, phrases):
+    length = max(1, int(rng.lognormvariate(0, config.words_sigma) * config.mean_words))
+    text = [rng.choice(words) for _ in range(length)]
+
+    if len(phrases) > 0 and rng.random() < config.phrase_density:
+        text.insert(rng.randint(0, len(text)), rng.choice(phrases))
+
+    return " ".join(text)[:MAX_MESSAGE_LENGTH]
+
+
+def generate_corpus(config, phrases):
+    """
+    Generates guilds, with members and text channels, and messages spread over them in time order.
+
+    :param config: CorpusConfig describing the corpus.
+    :param phrases: Tracked phrases, inserted into messages according to config.phrase_density.
+    :return: (array of StandInGuild, array of StandInMessage)
+    """
+    rng = random.Random(config.seed)
+
+    words = [_random_word(rng) for _ in range(config.vocabulary)]
+    copypastas = [" ".join([_random_text(rng, words, config, phrases)] * 3) for _ in range(config.copypastas)]
+
+    next_id = [0]
+
+    def snowflake():
+        next_id[0] += 1
+        return _snowflake(DISCORD_EPOCH + 10 ** 11, next_id[0])
+
+    guilds = []
+    for g in range(config.guilds):
+        guild = StandInGuild(snowflake(), "guild {}".format(g))
+
+        guild.members = [StandInUser(snowflake(), "user {}-{}".format(g, u)) for u in range(config.users_per_guild)]
+        guild.text_channels = [StandInTextChannel(snowflake(), "channel-{}".format(c), guild) for c in range(config.channels_per_guild)]
+
+        guilds.append(guild)
+
+    messages = []
+    timestamp = DISCORD_EPOCH + 10 ** 11
+    for i in range(config.messages):
+        timestamp += rng.randint(1, 5000)
+
+        guild = rng.choice(guilds)
+
+        if len(copypastas) > 0 and rng.random() < config.copypasta_rate:
+            content = rng.choice(copypastas)[:MAX_MESSAGE_LENGTH]
+        else:
+            content = _random_text(rng, words, config, phrases)
+
+        messages.append(StandInMessage(_snowflake(timestamp, i), content, rng.choice(guild.members), rng.choice(guild.text_channels)))
+
+    return guilds, messages
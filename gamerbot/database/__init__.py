@@ -9,3 +9,4 @@
 
 
 from .database import Database, Result
+from .pool import DatabasePool
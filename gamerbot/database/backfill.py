@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+from .tables import CHANNEL_BACKFILL, CHANNELS, MESSAGES
+
+
+def seed_backfill_checkpoints(database, channel_ids, before_uid):
+    """
+    Creates the missing backfill checkpoints of channels, before any of their live messages are ingested. Channels
+    ingested before checkpoints existed resume from their newest message stored before before_uid, every other channel
+    backfills its whole history. Existing checkpoints are left untouched.
+
+    :param database: Current active database connection.
+    :param channel_ids: Array of stored channel uids.
+    :param before_uid: Snowflake of when the bot started, messages from then on may come from live ingestion.
+    """
+    if len(channel_ids) == 0:
+        return
+
+    database.executeSql("INSERT INTO \"{0}\" (\"{1}\",\"{2}\") SELECT c.\"{3}\",COALESCE((SELECT MAX(m.\"{4}\") FROM \"{5}\" m "
+                        "WHERE m.\"{6}\" = c.\"{3}\" AND m.\"{4}\" < %(before_uid)s), 0) FROM \"{7}\" c "
+                        "WHERE c.\"{3}\" IN %(channel_ids)s ON CONFLICT (\"{1}\") DO NOTHING".format(
+                            CHANNEL_BACKFILL.name, CHANNEL_BACKFILL.CHANNEL_ID, CHANNEL_BACKFILL.LAST_MESSAGE_UID,
+                            CHANNELS.UID, MESSAGES.UID, MESSAGES.name, MESSAGES.CHANNEL_ID, CHANNELS.name),
+                        {'before_uid': before_uid, 'channel_ids': tuple(channel_ids)})
@@ -27,6 +27,13 @@ class Like(_Conditional):
         self.conditional = "LIKE"
 
 
+class ILike(_Conditional):
+    def __init__(self, column, value):
+        super().__init__(column, value)
+        self.name = "ilike"
+        self.conditional = "ILIKE"
+
+
 class Eq(_Conditional):
     def __init__(self, column, value):
         super().__init__(column, value)
@@ -37,6 +44,46 @@ class Eq(_Conditional):
         return "!="
 
 
+class Lt(_Conditional):
+    def __init__(self, column, value):
+        super().__init__(column, value)
+        self.name = "lt"
+        self.conditional = "<"
+
+    def negate(self):
+        return ">="
+
+
+class Lte(_Conditional):
+    def __init__(self, column, value):
+        super().__init__(column, value)
+        self.name = "lte"
+        self.conditional = "<="
+
+    def negate(self):
+        return ">"
+
+
+class Gt(_Conditional):
+    def __init__(self, column, value):
+        super().__init__(column, value)
+        self.name = "gt"
+        self.conditional = ">"
+
+    def negate(self):
+        return "<="
+
+
+class Gte(_Conditional):
+    def __init__(self, column, value):
+        super().__init__(column, value)
+        self.name = "gte"
+        self.conditional = ">="
+
+    def negate(self):
+        return "<"
+
+
 class In(_Conditional):
     def __init__(self, column, value):
         super().__init__(column, value)
@@ -6,9 +6,19 @@
 #
 # Author: Matt Struble
 # Date: Feb. 17 2020
+import asyncio
+import functools
+import itertools
+import operator
+import time
+
 from .ordering import _Ordering
+from .statements import StatementCache
+
+_cursor_ids = itertools.count()
 
 class ColumnFunction(object):
+    function = "SUM"
 
     def __init__(self, *columns):
         self.as_str = ""
@@ -18,13 +28,24 @@ class ColumnFunction(object):
     def AS(self, str):
         self.as_str = "AS {}".format(str)
         self.name = str
+        return self
 
-    def _to_sql(self):
-        return "SUM({}) {}".format(",".join(self.columns), self.as_str)
+    def _referenced_columns(self):
+        """
+        Plain columns the function reads, including the ones read by nested column functions.
+        """
+        columns = []
 
+        for column in self.columns:
+            if isinstance(column, ColumnFunction):
+                columns.extend(column._referenced_columns())
+            else:
+                columns.append(column)
+
+        return columns
 
-    def __eq__(self, other):
-        return other in self.columns
+    def _to_sql(self):
+        return "{}({}) {}".format(self.function, ",".join(str(c) for c in self.columns), self.as_str)
 
     def __repr__(self):
         return self._to_sql()
@@ -32,29 +53,51 @@ class ColumnFunction(object):
     def __str__(self):
         return self._to_sql()
 
-class Result(object):
-    def __init__(self, table, values, return_columns):
-        self.__name__ = table.name + "_result"
+class Result(tuple):
+    """
+    Row of a fetch result, readable as row[column], row.column or by position like a tuple.
 
-        self.dict = {}
+    A Result subclass is generated once per table and return column shape, see Result.for_columns, so a row costs a
+    single tuple instead of a dictionary and attributes per row.
+    """
+    __slots__ = ()
 
-        for i in range(len(return_columns)):
-            if isinstance(return_columns[i], ColumnFunction):
-                c = return_columns[i].name
-            else:
-                c = return_columns[i]
-            v = values[i]
-            self.dict[c] = v
-            setattr(self, c, v)
+    _fields = ()
+    _indexes = {}
+
+    def __new__(cls, values):
+        return tuple.__new__(cls, values)
+
+    @staticmethod
+    def for_columns(table, return_columns):
+        """
+        :return: The Result subclass for rows of the provided return columns.
+        """
+        fields = tuple(c.name if isinstance(c, ColumnFunction) else c for c in return_columns)
+        return _result_class(table.name, fields)
+
+    @property
+    def dict(self):
+        return dict(zip(self._fields, self))
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return tuple.__getitem__(self, self._indexes[item])
+
+        return tuple.__getitem__(self, item)
 
     def __repr__(self):
         return str(self.dict)
 
-    def __getitem__(self, item):
-        return self.dict[item]
 
-    def __len__(self):
-        return len(self.dict)
+@functools.lru_cache(maxsize=256)
+def _result_class(table_name, fields):
+    namespace = {'__slots__': (), '_fields': fields, '_indexes': {field: i for i, field in enumerate(fields)}}
+
+    for i, field in enumerate(fields):
+        namespace[field] = property(operator.itemgetter(i))
+
+    return type(table_name + "_result", (Result,), namespace)
 
 
 class Sum(ColumnFunction):
@@ -62,44 +105,240 @@ class Sum(ColumnFunction):
         super().__init__(columns)
         self.name = "sum"
 
+
+class Count(ColumnFunction):
+    function = "COUNT"
+
+    def __init__(self, *columns):
+        super().__init__(columns)
+        self.name = "count"
+
+
+class _WindowFunction(ColumnFunction):
+    """
+    Function evaluated over a window of rows, rendered as FUNCTION(columns) OVER (PARTITION BY ... ORDER BY ...).
+
+    Columns, partitions and orders may be plain columns or other column functions, so aggregates of a grouped query can
+    be windowed, e.g. SumOver(Sum(MATCHES)).OVER(partition_by=[USER_ID]).AS("total").
+    """
+    def __init__(self, *columns):
+        super().__init__(columns)
+        self.partition_by = []
+        self.order_by = []
+
+    def OVER(self, partition_by=(), order_by=()):
+        for order in order_by:
+            if type(order) is not tuple and type(order) is not list:
+                raise ValueError("Unexpected order ['{}'] expected tuple or list".format(order))
+
+            _Ordering._validate_ordering(order[1:])
+
+        self.partition_by = list(partition_by)
+        self.order_by = list(order_by)
+        return self
+
+    def _referenced_columns(self):
+        columns = super()._referenced_columns()
+
+        for column in self.partition_by + [order[0] for order in self.order_by]:
+            if isinstance(column, ColumnFunction):
+                columns.extend(column._referenced_columns())
+            else:
+                columns.append(column)
+
+        return columns
+
+    def _to_sql(self):
+        window = []
+
+        if len(self.partition_by) > 0:
+            window.append("PARTITION BY {}".format(",".join(str(c) for c in self.partition_by)))
+
+        if len(self.order_by) > 0:
+            window.append("ORDER BY {}".format(",".join(
+                " ".join([str(order[0])] + [component.sql for component in order[1:]]) for order in self.order_by)))
+
+        return "{}({}) OVER ({}) {}".format(self.function, ",".join(str(c) for c in self.columns), " ".join(window), self.as_str)
+
+
+class SumOver(_WindowFunction):
+    function = "SUM"
+
+    def __init__(self, column):
+        super().__init__(column)
+        self.name = "sum"
+
+
+class RowNumber(_WindowFunction):
+    function = "ROW_NUMBER"
+
+    def __init__(self):
+        super().__init__()
+        self.name = "row_number"
+
+
+class Rank(_WindowFunction):
+    function = "RANK"
+
+    def __init__(self):
+        super().__init__()
+        self.name = "rank"
+
+
+class DenseRank(_WindowFunction):
+    function = "DENSE_RANK"
+
+    def __init__(self):
+        super().__init__()
+        self.name = "dense_rank"
+
+
+class _DerivedTable(object):
+    """
+    A select used as the table of another select, see _FetchableDatabase.AS.
+    """
+    def __init__(self, name, columns, sql, values):
+        self.name = name
+        self.columns = tuple(columns)
+        self.non_pk_columns = self.columns
+        self.column_set = frozenset(self.columns)
+        self.sql = sql
+        self.values = values
+
 class Database(object):
-    def __init__(self, connection):
+    """
+    Query builder bound to a single connection.
+
+    When constructed with an executor the database runs in async mode: execute, commit, rollback and the fetch
+    methods return awaitables that run the blocking psycopg2 call on the executor instead of the event loop.
+
+    Parameterized statements are executed as server side prepared statements through statement_cache, set it to None
+    to send the full SQL every time instead, i.e. when connecting through a transaction pooling proxy.
+
+    Setting statement_seconds to a histogram with a single "statement" label times every executed statement, built or
+    run through executeSql, labelled by its shape: the parameterized SQL, with the values of inserts left out. Setting
+    slow_query_log to a SlowQueryLog logs the statements over its threshold.
+    """
+    statement_cache = StatementCache()
+    statement_seconds = None
+    slow_query_log = None
+
+    def __init__(self, connection, executor=None):
         self.connection = connection
+        self.executor = executor
         self.cursor = connection.cursor()
         self.table = None
+        self.aliases = set() # names of column functions selected by this query, usable like columns of its table
         self.sql = ""
         self.values = {}
 
     def commit(self):
-        self.connection.commit()
+        return self._run(self.connection.commit)
+
+    def rollback(self):
+        return self._run(self.connection.rollback)
 
     def selectFrom(self, table):
-        select = _SelectDatabase(self.connection, "*")
+        select = _SelectDatabase(self.connection, "*", self.executor)
         select = select.FROM(table)
         return select
 
     def select(self, *selections):
-        return _SelectDatabase(self.connection, selections)
+        return _SelectDatabase(self.connection, selections, self.executor)
 
     def insertInto(self, table, *columns):
-        return _InsertDatabase(self.connection, table, columns)
+        return _InsertDatabase(self.connection, table, columns, self.executor)
 
     def update(self, table):
-        return _UpdateDatabase(self.connection, table)
+        return _UpdateDatabase(self.connection, table, self.executor)
+
+    def run(self, func, *args):
+        """
+        Calls func(database, *args) with a synchronous database on this connection. In async mode the call is made on
+        the executor and an awaitable is returned, allowing multi statement helpers to run off of the event loop.
+        """
+        if self.executor is None:
+            return func(self, *args)
+
+        return self._run(func, Database(self.connection), *args)
 
     def execute(self):
-        if len(self.values) > 0:
+        return self._run(self._execute)
+
+    def executeSql(self, sql, values=None, shape=None):
+        """
+        Executes hand written SQL on this database's cursor, timed and slow query logged like the built statements.
+        Results are read from the cursor afterwards.
+
+        i.e:
+        db.executeSql("SELECT COUNT(*) FROM \"messages\" WHERE \"channel_id\" = %(channel_id)s", {'channel_id': 1234})
+        count = db.cursor.fetchone()[0]
+
+        :param sql: Statement, with placeholders if values are provided.
+        :param values: Optional dictionary, or sequence, of values for the placeholders.
+        :param shape: Label the statement is timed under, defaults to sql. Statements with values spliced into the SQL
+            pass the SQL without them, so every call doesn't get a label of its own.
+        """
+        return self._run(self._execute_sql, sql, values, shape)
+
+    def _execute(self):
+        self._observe(self.sql, self.values, self._statement_shape, self._execute_statement)
+
+    def _execute_sql(self, sql, values, shape):
+        self._observe(sql, values, lambda: sql if shape is None else shape, functools.partial(self.cursor.execute, sql, values))
+
+    def _observe(self, sql, values, shape, execute):
+        """
+        Calls execute, timing it into statement_seconds and handing it to slow_query_log when either is set.
+
+        :param sql: SQL being executed.
+        :param values: Values of the SQL's placeholders.
+        :param shape: Callable returning the statement's shape, only called when it is needed.
+        :param execute: Callable executing the statement.
+        """
+        if self.statement_seconds is None and self.slow_query_log is None:
+            execute()
+            return
+
+        start = time.perf_counter()
+        try:
+            execute()
+        finally:
+            duration = time.perf_counter() - start
+
+            if self.statement_seconds is not None:
+                self.statement_seconds.observe(duration, (shape(),))
+
+        if self.slow_query_log is not None:
+            self.slow_query_log.record(self, sql, values, shape(), duration)
+
+    def _execute_statement(self):
+        if len(self.values) > 0 and self.statement_cache is not None:
+            self.statement_cache.execute(self.connection, self.cursor, self.sql, self.values)
+        elif len(self.values) > 0:
             self.cursor.execute(self.sql, self.values)
         else:
             self.cursor.execute(self.sql)
 
+    def _statement_shape(self):
+        return self.sql
+
+    def _run(self, func, *args):
+        if self.executor is None:
+            return func(*args)
+
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
     def _validate_column(self, column):
-        if column not in self.table.columns:
+        if isinstance(column, ColumnFunction):
+            for referenced in column._referenced_columns():
+                self._validate_column(referenced)
+        elif column not in self.table.column_set and column not in self.aliases:
             raise ValueError("Unexpected column ['{}'] for table ['{}']".format(column, self.table.name))
 
 class _ConditionalDatabase(Database):
-    def __init__(self, connection):
-        super().__init__(connection)
+    def __init__(self, connection, executor=None):
+        super().__init__(connection, executor)
 
     def _validate_conditional(self, conditional):
         self._validate_column(conditional.column)
@@ -130,25 +369,78 @@ class _ConditionalDatabase(Database):
 
 
 class _FetchableDatabase(_ConditionalDatabase):
-    def __init__(self, connection):
-        super().__init__(connection)
+    def __init__(self, connection, executor=None):
+        super().__init__(connection, executor)
         self.return_columns = []
 
     def fetchone(self):
-        self.execute()
-        return self._convert_to_result(self.cursor.fetchone())
+        return self._run(self._fetchone)
 
     def fetchmany(self, size):
         if not isinstance(size, int):
             raise ValueError("Size needs to be an integer.")
 
-        self.execute()
-        return self._convert_to_result(self.cursor.fetchmany(size))
+        return self._run(self._fetchmany, size)
 
     def fetchall(self):
-        self.execute()
+        return self._run(self._fetchall)
+
+    def fetchiter(self, batch_size=1000):
+        """
+        Streams the results through a server side cursor, so only batch_size rows are held in memory at a time. The
+        cursor lives in the current transaction, which needs to stay open until the iteration is done.
+
+        i.e:
+        for batch in db.selectFrom(MESSAGE_CONTENT).fetchiter(5000):
+            ...
+
+        async for batch in async_db.selectFrom(MESSAGE_CONTENT).fetchiter(5000):
+            ...
+
+        :param batch_size: Number of rows fetched from the server per round trip.
+        :return: Generator of result batches, each an array of up to batch_size results. In async mode an async
+            iterator of the batches instead.
+        """
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError("Batch size needs to be a positive integer.")
+
+        if self.executor is None:
+            return self._fetchiter(batch_size)
+
+        return _AsyncBatchIterator(self, self._fetchiter(batch_size))
+
+    def _fetchone(self):
+        self._execute()
+        return self._convert_to_result(self.cursor.fetchone())
+
+    def _fetchmany(self, size):
+        self._execute()
+        return self._convert_to_result(self.cursor.fetchmany(size))
+
+    def _fetchall(self):
+        self._execute()
         return self._convert_to_result(self.cursor.fetchall())
 
+    def _fetchiter(self, batch_size):
+        # named cursors are declared server side, they can't execute prepared statements
+        cursor = self.connection.cursor(name="gamerbot_cursor_{}".format(next(_cursor_ids)))
+        cursor.itersize = batch_size
+
+        try:
+            if len(self.values) > 0:
+                cursor.execute(self.sql, self.values)
+            else:
+                cursor.execute(self.sql)
+
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    return
+
+                yield self._convert_to_result(rows)
+        finally:
+            cursor.close()
+
     def orderBy(self, *orderings):
         self.sql += _Ordering(self, orderings).to_sql()
         return self
@@ -167,28 +459,64 @@ class _FetchableDatabase(_ConditionalDatabase):
         self.sql += " LIMIT {}".format(count)
         return self
 
-    def _gen_result(self, value):
-        if len(self.return_columns) == 1:
-            return value[0]
-        else:
-            return Result(self.table, value, self.return_columns)
+    def AS(self, name):
+        """
+        Wraps this query as a derived table, which can be selected FROM like any other table. Its columns are the
+        query's return columns, with column functions exposed under their names.
+        """
+        columns = []
+        for column in self.return_columns:
+            columns.append(column.name if isinstance(column, ColumnFunction) else column)
+
+        return _DerivedTable(name, columns, self.sql, dict(self.values))
 
     def _convert_to_result(self, value):
         if value is None:
             return value
 
+        if len(self.return_columns) == 1:
+            if type(value) is tuple:
+                return value[0]
+
+            return [r[0] for r in value]
+
+        result_class = Result.for_columns(self.table, self.return_columns)
+
         if type(value) is tuple:
-            return self._gen_result(value)
-        else:
-            results = []
-            for r in value:
-                results.append(self._gen_result(r))
-            return results
+            return result_class(value)
+
+        return [result_class(r) for r in value]
+
+
+class _AsyncBatchIterator(object):
+    """
+    Async iterator advancing a _fetchiter generator on the database's executor.
+    """
+    def __init__(self, database, batches):
+        self.database = database
+        self.batches = batches
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        batch = await self.database._run(next, self.batches, None)
+
+        if batch is None:
+            raise StopAsyncIteration
+
+        return batch
+
+    async def aclose(self):
+        """
+        Closes the server side cursor when the iteration is stopped early.
+        """
+        await self.database._run(self.batches.close)
 
 
 class _SelectDatabase(_FetchableDatabase):
-    def __init__(self, connection, selections):
-        super().__init__(connection)
+    def __init__(self, connection, selections, executor=None):
+        super().__init__(connection, executor)
 
         if len(selections) == 0:
             raise ValueError("Selections needs to be a string with len > 0 or an array of len > 0")
@@ -198,21 +526,25 @@ class _SelectDatabase(_FetchableDatabase):
     def FROM(self, table):
         self.table = table
 
-        self.sql = "SELECT {} FROM \"{}\"".format(','.join(str(x) for x in self.return_columns), table.name)
+        if isinstance(table, _DerivedTable):
+            self.sql = "SELECT {} FROM ({}) AS \"{}\"".format(','.join(str(x) for x in self.return_columns), table.sql, table.name)
+            self.values.update(table.values)
+        else:
+            self.sql = "SELECT {} FROM \"{}\"".format(','.join(str(x) for x in self.return_columns), table.name)
 
-        if self.return_columns is '*':
+        if self.return_columns == '*':
             self.return_columns = self.table.columns
 
         for column in self.return_columns:
             self._validate_column(column)
             if isinstance(column, ColumnFunction):
-                self.table.columns.append(column.name)
+                self.aliases.add(column.name)
 
         return self
 
 class _ReturningDatabase(_FetchableDatabase):
-    def __init__(self, connection, table, sql, returning):
-        super().__init__(connection)
+    def __init__(self, connection, table, sql, returning, executor=None, shape=None):
+        super().__init__(connection, executor)
         self.table = table
 
         if len(returning) == 0:
@@ -222,11 +554,15 @@ class _ReturningDatabase(_FetchableDatabase):
             self._validate_column(column)
 
         self.sql = sql + " RETURNING {}".format(','.join(returning))
+        self.shape = (shape if shape is not None else sql) + " RETURNING {}".format(','.join(returning))
         self.return_columns = returning
 
+    def _statement_shape(self):
+        return self.shape
+
 class _InsertDatabase(Database):
-    def __init__(self, connection, table, insert_columns):
-        super().__init__(connection)
+    def __init__(self, connection, table, insert_columns, executor=None):
+        super().__init__(connection, executor)
 
         if len(insert_columns) == 0:
             raise ValueError("Insert columns need to contain at least one value.")
@@ -234,6 +570,7 @@ class _InsertDatabase(Database):
         self.table = table
         self.insert_columns = insert_columns
         self.inserts = []
+        self.conflict_sql = ""
 
         self.value_placeholder = "({})".format(','.join(['%s']*len(insert_columns)))
 
@@ -241,12 +578,13 @@ class _InsertDatabase(Database):
             self._validate_column(column)
 
         self.sql = "INSERT INTO \"{}\" ({}) VALUES ".format(table.name, ','.join('"{}"'.format(c) for c in insert_columns))
+        self.insert_sql = self.sql
 
     def _build_mogrifies(self):
         mogrifies = (self.cursor.mogrify(self.value_placeholder, tuple(x)) for x in self.inserts)
         arg_str = b','.join(mogrifies)
 
-        self.sql += arg_str.decode("utf-8")
+        self.sql += arg_str.decode("utf-8") + self.conflict_sql
 
     def _validate_sql(self):
         if len(self.inserts) == 0:
@@ -260,21 +598,89 @@ class _InsertDatabase(Database):
 
         return self
 
-    def execute(self):
+    def onConflict(self, *columns):
+        """
+        Starts an ON CONFLICT clause on the provided columns, which need to be backed by a unique index. Has to be
+        followed by doNothing or doUpdate.
+        """
+        if len(columns) == 0:
+            raise ValueError("Conflict columns need to contain at least one value.")
+
+        for column in columns:
+            self._validate_column(column)
+
+        self.conflict_sql = " ON CONFLICT ({})".format(','.join('"{}"'.format(c) for c in columns))
+
+        return self
+
+    def doNothing(self):
+        self._validate_conflict()
+        self.conflict_sql += " DO NOTHING"
+
+        return self
+
+    def doUpdate(self, *columns, changed_only=False):
+        """
+        Overwrites the provided columns of the conflicting row with the values proposed for insertion.
+
+        :param changed_only: Only update rows where at least one of the columns differs. Unchanged rows are left
+            untouched and are not returned by RETURNING.
+        """
+        self._validate_conflict()
+
+        if len(columns) == 0:
+            raise ValueError("Update columns need to contain at least one value.")
+
+        for column in columns:
+            self._validate_column(column)
+
+        self.conflict_sql += " DO UPDATE SET {}".format(','.join('"{0}" = EXCLUDED."{0}"'.format(c) for c in columns))
+
+        if changed_only:
+            self.conflict_sql += " WHERE ({}) IS DISTINCT FROM ({})".format(
+                ','.join('"{}"."{}"'.format(self.table.name, c) for c in columns),
+                ','.join('EXCLUDED."{}"'.format(c) for c in columns))
+
+        return self
+
+    def doIncrement(self, *columns):
+        """
+        Adds the values proposed for insertion to the provided columns of the conflicting row, for maintaining counters.
+        """
+        self._validate_conflict()
+
+        if len(columns) == 0:
+            raise ValueError("Increment columns need to contain at least one value.")
+
+        for column in columns:
+            self._validate_column(column)
+
+        self.conflict_sql += " DO UPDATE SET {}".format(','.join('"{1}" = "{0}"."{1}" + EXCLUDED."{1}"'.format(self.table.name, c) for c in columns))
+
+        return self
+
+    def _validate_conflict(self):
+        if not self.conflict_sql.startswith(" ON CONFLICT") or " DO " in self.conflict_sql:
+            raise ValueError("Conflict action needs to directly follow onConflict.")
+
+    def _execute(self):
         self._validate_sql()
         self._build_mogrifies()
-        super().execute()
+        super()._execute()
+
+    def _statement_shape(self):
+        return self.insert_sql + "..." + self.conflict_sql
 
     def returning(self, *returning):
         self._validate_sql()
         self._build_mogrifies()
 
-        return _ReturningDatabase(self.connection, self.table, self.sql, returning)
+        return _ReturningDatabase(self.connection, self.table, self.sql, returning, self.executor, self._statement_shape())
 
 
 class _UpdateDatabase(_ConditionalDatabase):
-    def __init__(self, connection, table):
-        super().__init__(connection)
+    def __init__(self, connection, table, executor=None):
+        super().__init__(connection, executor)
 
         self.table = table
 
@@ -6,7 +6,26 @@
 #
 # Author: Matt Struble
 # Date: Mar. 18 2020
+import hashlib
+
 from .conditionals import Eq, IsNull
+from .database import Result
+
+# The batched helpers send every row of a batch in a single statement. Helpers writing their own SQL mogrify the rows
+# and splice them in between a prefix and a suffix, as mogrified values may contain format characters. Upserts and
+# increments send their rows sorted on their key, so concurrent batches lock shared rows in the same order and can't
+# deadlock on each other.
+
+def content_digest(content):
+    """
+    Fixed width digest identifying a message content, matches sha256(convert_to(content, 'UTF8')) in Postgres.
+    """
+    return hashlib.sha256(content.encode("utf-8")).digest()
+
+
+def _key_value(value):
+    # bytea columns are returned as memoryviews, compare them as the bytes they were inserted as
+    return bytes(value) if isinstance(value, memoryview) else value
 
 
 def fetchone_from_table(database, table, values_dict, returning):
@@ -75,3 +94,238 @@ def ingest_if_not_exist(database, table, values_dict):
     if result is None:
         database.insertInto(table, *columns).prepare(*values).execute()
 
+
+
+def upsert_returning(database, table, values_dict, returning_columns, conflict_columns=None):
+    """
+    Resolves or creates the row matching a table_column:value dictionary mapping in a single statement, using
+    INSERT ... ON CONFLICT ... RETURNING. Unlike ingest_if_not_exist_returning this is safe against concurrent writers,
+    but the conflict columns need to be backed by a unique index.
+
+    :param database: Current active database connection.
+    :param table: Table to insert mapping into.
+    :param values_dict: A dictionary of table_column:value to ingest into the database.
+    :param returning_columns: A single column, or list of columns, you want returned.
+    :param conflict_columns: Columns identifying an existing row, defaults to the columns of values_dict.
+    :return: The row in the database filtered on the column(s) defined.
+    """
+    return upsert_many_returning(database, table, [values_dict], returning_columns, conflict_columns)[0]
+
+
+def upsert_many_returning(database, table, values_dicts, returning_columns, conflict_columns=None):
+    """
+    Batched form of upsert_returning. Resolves or creates every row in a single statement and returns the results in
+    the same order as values_dicts. Duplicate mappings are only sent once.
+
+    Existing rows are never written: new rows are inserted with ON CONFLICT DO NOTHING and the existing ones are
+    selected in the same statement. Rows committed concurrently after the statement started are invisible to it, they
+    are resolved by another round trip.
+
+    :param database: Current active database connection.
+    :param table: Table to insert mappings into.
+    :param values_dicts: An array of table_column:value dictionaries sharing the same columns.
+    :param returning_columns: A single column, or list of columns, you want returned.
+    :param conflict_columns: Columns identifying an existing row, defaults to the columns of the mappings.
+    :return: Array of rows in the database filtered on the column(s) defined, one per mapping.
+    """
+    if len(values_dicts) == 0:
+        return []
+
+    columns = list(values_dicts[0].keys())
+
+    if type(returning_columns) is not list and type(returning_columns) is not tuple:
+        returning_columns = [returning_columns]
+
+    if conflict_columns is None:
+        conflict_columns = columns
+
+    # conflict columns are returned as well to map the returned rows back to their mappings
+    returned_columns = list(returning_columns) + [c for c in conflict_columns if c not in returning_columns]
+
+    keys = []
+    pending = {}
+    for values_dict in values_dicts:
+        key = tuple(values_dict[c] for c in conflict_columns)
+        keys.append(key)
+        pending[key] = values_dict
+
+    value_placeholder = "({})".format(','.join(['%s'] * len(columns)))
+
+    prefix = "WITH \"v\"({columns}) AS (VALUES ".format(columns=','.join('"{}"'.format(c) for c in columns))
+    suffix = "), \"i\" AS (INSERT INTO \"{table}\" ({columns}) SELECT {columns} FROM \"v\" " \
+             "ON CONFLICT ({conflict}) DO NOTHING RETURNING {returned}) " \
+             "SELECT {returned} FROM \"i\" UNION ALL " \
+             "SELECT {table_returned} FROM \"{table}\" AS \"t\" JOIN \"v\" ON {join}".format(
+                 table=table.name,
+                 columns=','.join('"{}"'.format(c) for c in columns),
+                 conflict=','.join('"{}"'.format(c) for c in conflict_columns),
+                 returned=','.join('"{}"'.format(c) for c in returned_columns),
+                 table_returned=','.join('"t"."{}"'.format(c) for c in returned_columns),
+                 join=' AND '.join('"t"."{0}" = "v"."{0}"'.format(c) for c in conflict_columns))
+
+    result_class = Result.for_columns(table, returning_columns)
+    cursor = database.cursor
+
+    results = {}
+    while len(pending) > 0:
+        values = b','.join(cursor.mogrify(value_placeholder, tuple(pending[key][c] for c in columns))
+                           for key in sorted(pending.keys())).decode("utf-8")
+        database.executeSql(prefix + values + suffix, shape=prefix + "..." + suffix)
+
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            raise ValueError("Upserted rows of table ['{}'] could not be resolved on columns {}.".format(table.name, conflict_columns))
+
+        for row in rows:
+            key = tuple(_key_value(row[returned_columns.index(c)]) for c in conflict_columns)
+            results[key] = row[0] if len(returning_columns) == 1 else result_class(row[:len(returning_columns)])
+            pending.pop(key, None)
+
+    return [results[key] for key in keys]
+
+
+def insert_if_not_exist(database, table, values_dicts, conflict_columns, returning_columns=None):
+    """
+    Inserts every table_column:value dictionary mapping in a single statement, skipping rows that conflict with an
+    existing row on the conflict columns.
+
+    :param database: Current active database connection.
+    :param table: Table to insert mappings into.
+    :param values_dicts: An array of table_column:value dictionaries sharing the same columns.
+    :param conflict_columns: Columns, backed by a unique index, identifying an existing row.
+    :param returning_columns: Optional column, or list of columns, returned for the rows that were actually inserted.
+    :return: The inserted rows filtered on returning_columns, None if no returning_columns were provided.
+    """
+    if len(values_dicts) == 0:
+        return None if returning_columns is None else []
+
+    columns = list(values_dicts[0].keys())
+
+    db = database.insertInto(table, *columns)
+
+    for values_dict in values_dicts:
+        db = db.prepare(*[values_dict[c] for c in columns])
+
+    db = db.onConflict(*conflict_columns).doNothing()
+
+    if returning_columns is None:
+        db.execute()
+        return None
+
+    if type(returning_columns) is not list and type(returning_columns) is not tuple:
+        returning_columns = [returning_columns]
+
+    return db.returning(*returning_columns).fetchall()
+
+
+def increment_counts(database, table, key_columns, count_column, counts):
+    """
+    Adds counts onto a counter table in a single statement, creating missing rows.
+
+    :param database: Current active database connection.
+    :param table: Counter table, with a unique index on key_columns.
+    :param key_columns: Columns identifying a counter.
+    :param count_column: Column holding the count.
+    :param counts: A dictionary of key tuple:count to add, key tuples ordered as key_columns.
+    """
+    if len(counts) == 0:
+        return
+
+    db = database.insertInto(table, *(list(key_columns) + [count_column]))
+
+    for key in sorted(counts.keys()):
+        db = db.prepare(*(list(key) + [counts[key]]))
+
+    db.onConflict(*key_columns).doIncrement(count_column).execute()
+
+
+def sync_name_lookup_table(database, table, uid_column, name_id_column, name_table, name_column, rows, batch_size=5000):
+    """
+    Brings a uid:name lookup table, and its name table, in line with the provided rows using two set-based statements
+    per batch. Only names that don't exist yet are inserted, and only lookup rows that are new or whose name (or any
+    other provided column) changed are written.
+
+    i.e:
+    sync_name_lookup_table(db, USERS, USERS.UID, USERS.USER_NAME_ID, USER_NAMES, USER_NAMES.USER_NAME,
+                           [{USERS.UID: 1234, USER_NAMES.USER_NAME: "gamer"}])
+
+    :param database: Current active database connection.
+    :param table: Lookup table keyed on uid_column.
+    :param uid_column: Unique column of the lookup table.
+    :param name_id_column: Column of the lookup table referencing the name table.
+    :param name_table: Table holding the unique names, with an id column.
+    :param name_column: Unique name column of the name table.
+    :param rows: An array of dictionaries holding uid_column, name_column and any other lookup table columns to set.
+    :param batch_size: Maximum number of rows sent per statement.
+    :return: Dictionary of uid:name_id for every provided row.
+    """
+    if len(rows) == 0:
+        return {}
+
+    columns = list(rows[0].keys())
+    extra_columns = [c for c in columns if c != uid_column and c != name_column]
+    update_columns = [name_id_column] + extra_columns
+
+    value_placeholder = "({})".format(','.join(['%s'] * len(columns)))
+
+    names_prefix = "INSERT INTO \"{0}\" (\"{1}\") SELECT DISTINCT \"v\".\"{1}\" FROM (VALUES ".format(name_table.name, name_column)
+    names_suffix = ") AS \"v\"(\"{0}\") ON CONFLICT (\"{0}\") DO NOTHING".format(name_column)
+
+    # the resolved rows are selected from the CTE so every row's name id is returned, not only the written ones
+    lookup_prefix = "WITH \"v\" AS (SELECT \"r\".\"{uid}\",\"n\".\"{name_id}\" AS \"{name_id_column}\"{extra_select} FROM (VALUES ".format(
+        uid=uid_column, name_id=name_table.ID, name_id_column=name_id_column,
+        extra_select=''.join(',"r"."{}"'.format(c) for c in extra_columns))
+
+    lookup_suffix = ") AS \"r\"({value_columns}) " \
+                    "JOIN \"{name_table}\" AS \"n\" ON \"n\".\"{name}\" = \"r\".\"{name}\"), " \
+                    "\"u\" AS (INSERT INTO \"{table}\" (\"{uid}\",{insert_columns}) SELECT \"{uid}\",{insert_columns} FROM \"v\" " \
+                    "ON CONFLICT (\"{uid}\") DO UPDATE SET {set_columns} " \
+                    "WHERE ({current_columns}) IS DISTINCT FROM ({excluded_columns})) " \
+                    "SELECT \"{uid}\",\"{name_id_column}\" FROM \"v\"".format(
+                        table=table.name, uid=uid_column, name_id_column=name_id_column, name_table=name_table.name,
+                        name=name_column,
+                        value_columns=','.join('"{}"'.format(c) for c in columns),
+                        insert_columns=','.join('"{}"'.format(c) for c in update_columns),
+                        set_columns=','.join('"{0}" = EXCLUDED."{0}"'.format(c) for c in update_columns),
+                        current_columns=','.join('"{}"."{}"'.format(table.name, c) for c in update_columns),
+                        excluded_columns=','.join('EXCLUDED."{}"'.format(c) for c in update_columns))
+
+    cursor = database.cursor
+    name_ids = {}
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+
+        names = b','.join(cursor.mogrify("(%s)", (row[name_column],)) for row in batch).decode("utf-8")
+        database.executeSql(names_prefix + names + names_suffix, shape=names_prefix + "..." + names_suffix)
+
+        values = b','.join(cursor.mogrify(value_placeholder, tuple(row[c] for c in columns)) for row in batch).decode("utf-8")
+        database.executeSql(lookup_prefix + values + lookup_suffix, shape=lookup_prefix + "..." + lookup_suffix)
+
+        name_ids.update(cursor.fetchall())
+
+    return name_ids
+
+
+def fetch_name_lookup_table(database, table, uid_column, name_id_column, name_table, name_column, limit=None):
+    """
+    Reads a uid:name lookup table together with its names, i.e. to warm a cache.
+
+    :param database: Current active database connection.
+    :param table: Lookup table keyed on uid_column.
+    :param uid_column: Unique column of the lookup table.
+    :param name_id_column: Column of the lookup table referencing the name table.
+    :param name_table: Table holding the unique names, with an id column.
+    :param name_column: Name column of the name table.
+    :param limit: Maximum number of rows to read, None to read every row.
+    :return: Dictionary of uid:(name, name_id).
+    """
+    sql = "SELECT \"t\".\"{}\",\"n\".\"{}\",\"t\".\"{}\" FROM \"{}\" AS \"t\" JOIN \"{}\" AS \"n\" ON \"n\".\"{}\" = \"t\".\"{}\"".format(
+        uid_column, name_column, name_id_column, table.name, name_table.name, name_table.ID, name_id_column)
+
+    if limit is not None:
+        sql += " LIMIT {}".format(int(limit))
+
+    database.executeSql(sql)
+
+    return {uid: (name, name_id) for uid, name, name_id in database.cursor.fetchall()}
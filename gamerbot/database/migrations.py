@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+import logging
+import os
+
+from .partitions import ensure_partitions
+from .rollups import rebuild_rollups
+from .tables import CHANNEL_BACKFILL, CHANNEL_NAMES, CHANNEL_PHRASE_COUNTS, CHANNELS, GUILD_NAMES, GUILD_PHRASE_COUNTS, \
+    GUILDS, MESSAGE_CONTENT, MESSAGES, PHRASES, REMOVED_PHRASES, SCHEMA_MIGRATIONS, USER_MATCHED_PHRASES, USER_NAMES, USERS
+
+log = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "schema",
+                           "gamer-bot_postgres_create.sql")
+
+# session level advisory lock serializing bots migrating the same database
+MIGRATION_LOCK_ID = 7165616962
+
+TRIGRAM_INDEX = "idx_message_content_trgm"
+
+
+def _initial_schema(database):
+    # databases set up by hand from the schema file, before migrations existed, already have the baseline. The later
+    # migrations bring them up to date, and tolerate the parts of their changes that are already in place.
+    database.cursor.execute("SELECT to_regclass(%s)", ("\"{}\"".format(PHRASES.name),))
+    if database.cursor.fetchone()[0] is not None:
+        return
+
+    with open(SCHEMA_PATH) as f:
+        database.cursor.execute(f.read())
+
+
+def _deduplicate(database, table, value_column, references):
+    """
+    Keeps the lowest id of every value of table's value_column, repointing the references to the deleted ids first.
+
+    :param table: Table with an "id" column, i.e. USER_NAMES.
+    :param value_column: Column the duplicates share.
+    :param references: Array of (table, column) referencing table's ids.
+    """
+    cursor = database.cursor
+
+    duplicates = "SELECT \"id\",MIN(\"id\") OVER (PARTITION BY \"{}\") AS \"keep_id\" FROM \"{}\"".format(value_column, table.name)
+
+    for referencing_table, column in references:
+        cursor.execute("UPDATE \"{0}\" r SET \"{1}\" = d.\"keep_id\" FROM ({2}) d "
+                       "WHERE r.\"{1}\" = d.\"id\" AND d.\"id\" <> d.\"keep_id\"".format(referencing_table.name, column, duplicates))
+
+    cursor.execute("DELETE FROM \"{0}\" a USING \"{0}\" b WHERE a.\"{1}\" = b.\"{1}\" AND a.\"id\" > b.\"id\"".format(
+        table.name, value_column))
+
+
+def _unique_lookups(database):
+    """
+    Makes the name and content lookups and the message phrase pairs unique, so they can be upserted with ON CONFLICT.
+    Rows stored twice before are merged into their oldest copy.
+    """
+    ump = USER_MATCHED_PHRASES
+    cursor = database.cursor
+
+    lookups = [
+        (USER_NAMES, USER_NAMES.USER_NAME, [(USERS, USERS.USER_NAME_ID)], "idx_user_names"),
+        (GUILD_NAMES, GUILD_NAMES.GUILD_NAME, [(GUILDS, GUILDS.GUILD_NAME_ID)], "idx_guild_names"),
+        (CHANNEL_NAMES, CHANNEL_NAMES.CHANNEL_NAME, [(CHANNELS, CHANNELS.CHANNEL_NAME_ID)], "idx_channel_names"),
+        (MESSAGE_CONTENT, MESSAGE_CONTENT.CONTENT, [(MESSAGES, MESSAGES.MESSAGE_CONTENT_ID)], "idx_message_content"),
+    ]
+
+    for table, column, references, index in lookups:
+        _deduplicate(database, table, column, references)
+
+        cursor.execute("DROP INDEX IF EXISTS \"{}\"".format(index))
+        cursor.execute("CREATE UNIQUE INDEX \"{}\" ON \"{}\"(\"{}\")".format(index, table.name, column))
+
+    cursor.execute("DELETE FROM \"{0}\" a USING \"{0}\" b WHERE a.\"{1}\" = b.\"{1}\" AND a.\"{2}\" = b.\"{2}\" "
+                   "AND a.\"{3}\" > b.\"{3}\"".format(ump.name, ump.MESSAGE_ID, ump.PHRASE_ID, ump.ID))
+
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS \"idx_user_matched_phrases_message_phrase\" "
+                   "ON \"{}\"(\"{}\", \"{}\")".format(ump.name, ump.MESSAGE_ID, ump.PHRASE_ID))
+
+
+def _channel_backfill(database):
+    """
+    Checkpoints of the channel history backfill, seeded for existing channels when the bot next connects.
+    """
+    database.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS "{0}" (
+            "{1}" bigint NOT NULL,
+            "{2}" bigint NOT NULL,
+            CONSTRAINT "{0}_pk" PRIMARY KEY ("{1}"),
+            CONSTRAINT "{0}_fk0" FOREIGN KEY ("{1}") REFERENCES "{3}"("{4}")
+        )
+    """.format(CHANNEL_BACKFILL.name, CHANNEL_BACKFILL.CHANNEL_ID, CHANNEL_BACKFILL.LAST_MESSAGE_UID, CHANNELS.name, CHANNELS.UID))
+
+
+def _phrase_count_rollups(database):
+    """
+    Per guild and per channel phrase count rollups, built from the stored matches.
+    """
+    for table, scope in [(GUILD_PHRASE_COUNTS, GUILD_PHRASE_COUNTS.GUILD_ID), (CHANNEL_PHRASE_COUNTS, CHANNEL_PHRASE_COUNTS.CHANNEL_ID)]:
+        database.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS "{0}" (
+                "{1}" bigint NOT NULL,
+                "{2}" bigint NOT NULL,
+                "{3}" integer NOT NULL,
+                "{4}" bigint NOT NULL,
+                CONSTRAINT "{0}_pk" PRIMARY KEY ("{1}","{2}","{3}"),
+                CONSTRAINT "{0}_fk0" FOREIGN KEY ("{3}") REFERENCES "{5}"("{6}")
+            )
+        """.format(table.name, scope, table.USER_ID, table.PHRASE_ID, table.MATCHES, PHRASES.name, PHRASES.ID))
+
+    database.cursor.execute("CREATE INDEX IF NOT EXISTS \"idx_guild_phrase_counts_user_id\" ON \"{}\"(\"{}\")".format(
+        GUILD_PHRASE_COUNTS.name, GUILD_PHRASE_COUNTS.USER_ID))
+
+    rebuild_rollups(database)
+
+
+def _content_trigram_index(database):
+    """
+    Trigram index letting ILIKE find the candidate contents of a new phrase. Skipped when pg_trgm can't be created, the
+    startup check of ensure_trigram_index warns about it and creates the index once the extension is installed.
+    """
+    ensure_trigram_index(database, warn=False)
+
+
+def ensure_trigram_index(database, warn=True):
+    """
+    Creates the trigram index on message content, and the pg_trgm extension it needs if the bot's role is allowed to.
+    pg_trgm isn't a trusted extension before PostgreSQL 13, so it can only be created by a superuser. Without the index,
+    counting a new phrase scans every message content.
+
+    :param database: Synchronous database, i.e. from DatabasePool.database().
+    :param warn: Logs a warning when the index can't be created.
+    :return: True if the index exists.
+    """
+    cursor = database.cursor
+
+    cursor.execute("SELECT to_regclass(%s)", ("\"{}\"".format(TRIGRAM_INDEX),))
+    if cursor.fetchone()[0] is not None:
+        return True
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+    if not cursor.fetchone()[0]:
+        reason = _trigram_unavailable_reason(database)
+        if reason is not None:
+            if warn:
+                log.warning("Skipped the trigram index on message content, %s. Counting a new phrase scans every message "
+                            "content until pg_trgm is installed, see the README.", reason)
+            return False
+
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS \"pg_trgm\"")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS \"{}\" ON \"{}\" USING gin (\"{}\" gin_trgm_ops)".format(
+        TRIGRAM_INDEX, MESSAGE_CONTENT.name, MESSAGE_CONTENT.CONTENT))
+
+    return True
+
+
+def _trigram_unavailable_reason(database):
+    """
+    :return: Why the current role can't create the pg_trgm extension, None if it can.
+    """
+    cursor = database.cursor
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+    if not cursor.fetchone()[0]:
+        return "pg_trgm isn't available on the server"
+
+    cursor.execute("SELECT rolsuper FROM pg_roles WHERE rolname = current_user")
+    if cursor.fetchone()[0]:
+        return None
+
+    # trusted extensions can be created by any role allowed to create objects in the database from PostgreSQL 13 on
+    if database.connection.server_version >= 130000:
+        cursor.execute("SELECT v.trusted AND has_database_privilege(current_database(), 'CREATE') "
+                       "FROM pg_available_extension_versions v "
+                       "JOIN pg_available_extensions e ON e.name = v.name AND e.default_version = v.version "
+                       "WHERE v.name = 'pg_trgm'")
+        row = cursor.fetchone()
+        if row is not None and row[0]:
+            return None
+
+    return "the database role isn't allowed to create the pg_trgm extension"
+
+
+def _content_digest(database):
+    """
+    Looks message contents up by a fixed width sha256 digest instead of the content itself. The digest is computed
+    like content_digest does, contents are already unique so their digests are too.
+    """
+    cursor = database.cursor
+
+    cursor.execute("ALTER TABLE \"{}\" ADD COLUMN IF NOT EXISTS \"{}\" bytea".format(MESSAGE_CONTENT.name, MESSAGE_CONTENT.DIGEST))
+    cursor.execute("UPDATE \"{0}\" SET \"{1}\" = sha256(convert_to(\"{2}\", 'UTF8')) WHERE \"{1}\" IS NULL".format(
+        MESSAGE_CONTENT.name, MESSAGE_CONTENT.DIGEST, MESSAGE_CONTENT.CONTENT))
+    cursor.execute("ALTER TABLE \"{}\" ALTER COLUMN \"{}\" SET NOT NULL".format(MESSAGE_CONTENT.name, MESSAGE_CONTENT.DIGEST))
+
+    cursor.execute("DROP INDEX IF EXISTS \"idx_message_content\"")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS \"idx_message_content_digest\" ON \"{}\"(\"{}\")".format(
+        MESSAGE_CONTENT.name, MESSAGE_CONTENT.DIGEST))
+
+
+def _partition_messages(database):
+    """
+    Rebuilds messages and user_matched_phrases as tables range partitioned on the message snowflake. Unique constraints
+    of partitioned tables have to contain the partition key, user_matched_phrases' primary key becomes
+    (message_id, phrase_id), which replaces the unique index ingestion conflicts on.
+    """
+    ump = USER_MATCHED_PHRASES
+    cursor = database.cursor
+
+    sequence = "{}_{}_seq".format(ump.name, ump.ID)
+
+    cursor.execute("LOCK TABLE \"{}\", \"{}\" IN ACCESS EXCLUSIVE MODE".format(MESSAGES.name, ump.name))
+
+    for table in [MESSAGES, ump]:
+        cursor.execute("ALTER TABLE \"{0}\" RENAME TO \"{0}_unpartitioned\"".format(table.name))
+
+    # the id sequence would be dropped together with the old table
+    cursor.execute("ALTER SEQUENCE \"{}\" OWNED BY NONE".format(sequence))
+
+    cursor.execute("CREATE TABLE \"{}\" (\"{}\" bigint NOT NULL, \"{}\" bigint NOT NULL, \"{}\" bigint NOT NULL, "
+                   "\"{}\" integer NOT NULL, \"{}\" TIMESTAMP NOT NULL) PARTITION BY RANGE (\"{}\")".format(
+                       MESSAGES.name, MESSAGES.UID, MESSAGES.USER_ID, MESSAGES.CHANNEL_ID, MESSAGES.MESSAGE_CONTENT_ID,
+                       MESSAGES.CREATED_AT, MESSAGES.UID))
+
+    cursor.execute("CREATE TABLE \"{}\" (\"{}\" integer NOT NULL DEFAULT nextval('\"{}\"'), \"{}\" integer NOT NULL, "
+                   "\"{}\" bigint NOT NULL, \"{}\" bigint NOT NULL, \"{}\" bigint NOT NULL, \"{}\" bigint NOT NULL, "
+                   "\"{}\" integer NOT NULL) PARTITION BY RANGE (\"{}\")".format(
+                       ump.name, ump.ID, sequence, ump.PHRASE_ID, ump.USER_ID, ump.GUILD_ID, ump.CHANNEL_ID,
+                       ump.MESSAGE_ID, ump.MATCHES, ump.MESSAGE_ID))
+
+    ensure_partitions(database)
+
+    # rows are copied before any index exists, indexes are built once at the end
+    for table in [MESSAGES, ump]:
+        columns = ",".join("\"{}\"".format(c) for c in table.columns)
+        cursor.execute("INSERT INTO \"{0}\" ({1}) SELECT {1} FROM \"{0}_unpartitioned\"".format(table.name, columns))
+
+    for table in [ump, MESSAGES]:
+        cursor.execute("DROP TABLE \"{}_unpartitioned\"".format(table.name))
+
+    cursor.execute("ALTER SEQUENCE \"{}\" OWNED BY \"{}\".\"{}\"".format(sequence, ump.name, ump.ID))
+
+    cursor.execute("""
+        ALTER TABLE "messages" ADD CONSTRAINT "messages_uid_key" UNIQUE ("uid");
+        ALTER TABLE "messages" ADD CONSTRAINT "messages_fk0" FOREIGN KEY ("user_id") REFERENCES "users"("uid");
+        ALTER TABLE "messages" ADD CONSTRAINT "messages_fk1" FOREIGN KEY ("channel_id") REFERENCES "channels"("uid");
+        ALTER TABLE "messages" ADD CONSTRAINT "messages_fk2" FOREIGN KEY ("message_content_id") REFERENCES "message_content"("id");
+
+        ALTER TABLE "user_matched_phrases" ADD CONSTRAINT "user_matched_phrases_pk" PRIMARY KEY ("message_id", "phrase_id");
+        ALTER TABLE "user_matched_phrases" ADD CONSTRAINT "user_matched_phrases_fk0" FOREIGN KEY ("phrase_id") REFERENCES "phrases"("id");
+        ALTER TABLE "user_matched_phrases" ADD CONSTRAINT "user_matched_phrases_fk1" FOREIGN KEY ("user_id") REFERENCES "users"("uid");
+        ALTER TABLE "user_matched_phrases" ADD CONSTRAINT "user_matched_phrases_fk2" FOREIGN KEY ("guild_id") REFERENCES "guilds"("uid");
+        ALTER TABLE "user_matched_phrases" ADD CONSTRAINT "user_matched_phrases_fk3" FOREIGN KEY ("channel_id") REFERENCES "channels"("uid");
+        ALTER TABLE "user_matched_phrases" ADD CONSTRAINT "user_matched_phrases_fk4" FOREIGN KEY ("message_id") REFERENCES "messages"("uid");
+
+        CREATE INDEX "idx_messages_user_id" ON "messages"("user_id");
+        CREATE INDEX "idx_messages_channel_id" ON "messages"("channel_id");
+        CREATE INDEX "idx_messages_created_at" ON "messages"("created_at");
+
+        CREATE INDEX "idx_user_matched_phrases_phrase_id" ON "user_matched_phrases"("phrase_id");
+        CREATE INDEX "idx_user_matched_phrases_user_id" ON "user_matched_phrases"("user_id");
+        CREATE INDEX "idx_user_matched_phrases_guild_id" ON "user_matched_phrases"("guild_id");
+        CREATE INDEX "idx_user_matched_phrases_channel_id" ON "user_matched_phrases"("channel_id");
+    """)
+
+
+def _covering_stats_indexes(database):
+    """
+    Lets the stats queries and rollup rebuilds run as index only scans. The rollup primary keys carry the matches,
+    leaderboards of a guild or channel read them in group order straight from the index.
+    """
+    for table, scope in [(GUILD_PHRASE_COUNTS, GUILD_PHRASE_COUNTS.GUILD_ID), (CHANNEL_PHRASE_COUNTS, CHANNEL_PHRASE_COUNTS.CHANNEL_ID)]:
+        database.cursor.execute("ALTER TABLE \"{0}\" DROP CONSTRAINT \"{0}_pk\", ADD CONSTRAINT \"{0}_pk\" "
+                                "PRIMARY KEY (\"{1}\",\"{2}\",\"{3}\") INCLUDE (\"{4}\")".format(
+                                    table.name, scope, table.USER_ID, table.PHRASE_ID, table.MATCHES))
+
+    database.cursor.execute("""
+        DROP INDEX "idx_guild_phrase_counts_user_id";
+        CREATE INDEX "idx_guild_phrase_counts_user_phrase" ON "guild_phrase_counts"("user_id", "phrase_id") INCLUDE ("matches");
+
+        DROP INDEX "idx_user_matched_phrases_guild_id";
+        CREATE INDEX "idx_user_matched_phrases_guild_user_phrase" ON "user_matched_phrases"("guild_id", "user_id", "phrase_id") INCLUDE ("channel_id", "matches");
+
+        DROP INDEX "idx_messages_channel_id";
+        CREATE INDEX "idx_messages_channel_uid" ON "messages"("channel_id", "uid") INCLUDE ("user_id", "message_content_id");
+    """)
+
+
+def _removed_phrases(database):
+    """
+    Remembers the phrases removed at runtime, so phrases still listed in the config aren't tracked again on restart.
+    """
+    database.cursor.execute("CREATE TABLE IF NOT EXISTS \"{0}\" (\"{1}\" varchar(2000) NOT NULL, "
+                            "CONSTRAINT \"{0}_pk\" PRIMARY KEY (\"{1}\"))".format(REMOVED_PHRASES.name, REMOVED_PHRASES.PHRASE))
+
+
+# (version, description, migration), versions are applied in order and never change once released
+MIGRATIONS = (
+    (1, "baseline schema", _initial_schema),
+    (2, "unique name, content and message phrase lookups", _unique_lookups),
+    (3, "channel backfill checkpoints", _channel_backfill),
+    (4, "guild and channel phrase count rollups", _phrase_count_rollups),
+    (5, "trigram index on message content", _content_trigram_index),
+    (6, "message content digest", _content_digest),
+    (7, "range partition messages and user_matched_phrases on the message snowflake", _partition_messages),
+    (8, "covering indexes for the stats queries", _covering_stats_indexes),
+    (9, "removed phrases", _removed_phrases),
+)
+
+
+def get_applied_versions(database):
+    database.cursor.execute("CREATE TABLE IF NOT EXISTS \"{}\" (\"{}\" integer NOT NULL PRIMARY KEY, \"{}\" varchar(200) NOT NULL, "
+                            "\"{}\" TIMESTAMP NOT NULL DEFAULT now())".format(SCHEMA_MIGRATIONS.name, SCHEMA_MIGRATIONS.VERSION,
+                                                                               SCHEMA_MIGRATIONS.DESCRIPTION, SCHEMA_MIGRATIONS.APPLIED_AT))
+
+    return set(database.select(SCHEMA_MIGRATIONS.VERSION).FROM(SCHEMA_MIGRATIONS).fetchall())
+
+
+def migrate(database, migrations=MIGRATIONS):
+    """
+    Applies every migration missing from schema_migrations, each in its own transaction together with its version
+    row. A failing migration is rolled back and raised, leaving the database at the last applied version.
+
+    :param database: Synchronous database, i.e. from DatabasePool.database().
+    :return: Array of the versions that were applied.
+    """
+    cursor = database.cursor
+    applied = []
+
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        applied_versions = get_applied_versions(database)
+        database.commit()
+
+        for version, description, migration in migrations:
+            if version in applied_versions:
+                continue
+
+            log.info("Applying schema migration %d: %s", version, description)
+
+            try:
+                migration(database)
+
+                database.insertInto(SCHEMA_MIGRATIONS, SCHEMA_MIGRATIONS.VERSION, SCHEMA_MIGRATIONS.DESCRIPTION)\
+                    .prepare(version, description).execute()
+                database.commit()
+            except:
+                database.rollback()
+                raise
+
+            applied.append(version)
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        database.commit()
+
+    return applied
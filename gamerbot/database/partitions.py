@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+import datetime
+
+from .tables import MESSAGES, USER_MATCHED_PHRASES
+
+# milliseconds since the unix epoch of the first discord snowflake, 2015-01-01
+DISCORD_EPOCH = 1420070400000
+FIRST_PARTITION_YEAR = 2015
+
+# messages and their matches are range partitioned on the message's snowflake, which is time ordered
+PARTITIONED_TABLES = (MESSAGES, USER_MATCHED_PHRASES)
+
+
+def snowflake_at(moment):
+    """
+    :param moment: Naive UTC datetime.
+    :return: Smallest snowflake created at or after moment.
+    """
+    milliseconds = int((moment - datetime.datetime(1970, 1, 1)).total_seconds() * 1000)
+
+    return max(0, milliseconds - DISCORD_EPOCH) << 22
+
+
+def partition_name(table, year):
+    return "{}_y{}".format(table.name, year)
+
+
+def create_partitions(database, table, first_year, last_year):
+    """
+    Creates the yearly partitions of table from first_year through last_year, existing partitions are left untouched.
+    The first partition of FIRST_PARTITION_YEAR is unbounded below.
+    """
+    for year in range(first_year, last_year + 1):
+        if year == FIRST_PARTITION_YEAR:
+            lower = "MINVALUE"
+        else:
+            lower = str(snowflake_at(datetime.datetime(year, 1, 1)))
+
+        upper = snowflake_at(datetime.datetime(year + 1, 1, 1))
+
+        database.cursor.execute("CREATE TABLE IF NOT EXISTS \"{}\" PARTITION OF \"{}\" FOR VALUES FROM ({}) TO ({})".format(
+            partition_name(table, year), table.name, lower, upper))
+
+
+def ensure_partitions(database, years_ahead=1, now=None):
+    """
+    Makes sure every partitioned table has a partition from FIRST_PARTITION_YEAR through years_ahead years from now, so
+    backfilled history and new messages always have a partition to land in.
+
+    :param now: Naive UTC datetime the years are counted from, defaults to the current time.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    for table in PARTITIONED_TABLES:
+        create_partitions(database, table, FIRST_PARTITION_YEAR, now.year + years_ahead)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from .database import Database
+
+
+class DatabasePool(object):
+    """
+    Bounded pool of PostgreSQL connections shared by the bot's event handlers.
+
+    Each acquired database owns its connection until it is released, so concurrent handlers never share a cursor or
+    a transaction. Blocking psycopg2 calls are run on a thread pool sized to the maximum number of connections.
+    """
+    def __init__(self, min_size, max_size, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size min [{}] max [{}].".format(min_size, max_size))
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.executor = ThreadPoolExecutor(max_workers=max_size)
+
+        self._pool = ThreadedConnectionPool(min_size, max_size, **connect_kwargs)
+        self._semaphore = None
+
+    def acquire(self):
+        """
+        Async context manager yielding an async mode Database on a pooled connection. Waits while the pool is
+        exhausted, and rolls back anything left uncommitted when the connection is returned.
+
+        async with pool.acquire() as db:
+            row = await db.selectFrom(PHRASES).fetchall()
+            await db.commit()
+        """
+        return _PooledDatabase(self)
+
+    @contextmanager
+    def database(self):
+        """
+        Synchronous counterpart of acquire, intended for startup and shutdown work outside of the event loop.
+        """
+        connection = self._pool.getconn()
+        try:
+            yield Database(connection)
+        finally:
+            self._release(connection)
+
+    def close(self):
+        self._pool.closeall()
+        self.executor.shutdown(wait=False)
+
+    def _get_semaphore(self):
+        # created lazily so the semaphore binds to the loop the bot is actually running on
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_size)
+
+        return self._semaphore
+
+    def _release(self, connection):
+        try:
+            connection.rollback()
+        finally:
+            self._pool.putconn(connection)
+
+
+class _PooledDatabase(object):
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+
+    async def __aenter__(self):
+        semaphore = self.pool._get_semaphore()
+        await semaphore.acquire()
+
+        try:
+            loop = asyncio.get_event_loop()
+            self.connection = await loop.run_in_executor(self.pool.executor, self.pool._pool.getconn)
+        except:
+            semaphore.release()
+            raise
+
+        return Database(self.connection, self.pool.executor)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self.pool.executor, self.pool._release, self.connection)
+        finally:
+            self.connection = None
+            self.pool._get_semaphore().release()
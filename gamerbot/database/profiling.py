@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+EXPLAIN_SAVEPOINT = "gamerbot_explain"
+
+_EXPLAINABLE = frozenset(["SELECT", "INSERT", "UPDATE", "DELETE", "WITH"])
+
+
+class SlowQueryLog(object):
+    """
+    Logs every statement slower than threshold_ms with its SQL, parameters and duration. The first explain_limit slow
+    occurrences of every statement shape also log their EXPLAIN (ANALYZE, BUFFERS) plan.
+
+    EXPLAIN ANALYZE executes the statement a second time. It runs on its own cursor inside a savepoint that is always
+    rolled back, so the explained statement's writes are undone and a failing EXPLAIN leaves the caller's transaction
+    usable. Connections in autocommit mode only explain SELECT statements.
+
+    i.e:
+    Database.slow_query_log = SlowQueryLog(threshold_ms=200, explain_limit=3)
+    """
+    def __init__(self, threshold_ms=500, explain_limit=0):
+        """
+        :param threshold_ms: Statements taking at least this many milliseconds are logged.
+        :param explain_limit: Number of slow occurrences per statement shape to capture the plan of, 0 disables EXPLAIN.
+        """
+        if threshold_ms < 0:
+            raise ValueError("Threshold needs to be a non negative number of milliseconds.")
+
+        if explain_limit < 0:
+            raise ValueError("Explain limit needs to be a non negative integer.")
+
+        self.threshold = threshold_ms / 1000
+        self.explain_limit = explain_limit
+
+        self._explained = {} # statement shape: number of captured plans
+        self._lock = threading.Lock()
+
+    def record(self, database, sql, values, shape, duration):
+        """
+        :param database: Database that executed the statement, its connection is used for EXPLAIN.
+        :param sql: Executed SQL.
+        :param values: Values of the SQL's placeholders, None or empty if it has none.
+        :param shape: Shape of the statement, see Database.
+        :param duration: Seconds the statement took.
+        """
+        if duration < self.threshold:
+            return
+
+        log.warning("Slow statement took %.1f ms: %s params: %s", duration * 1000, sql, values)
+
+        if self._should_explain(database, sql, shape):
+            plan = self._explain(database, sql, values, shape)
+            if plan is not None:
+                log.warning("Plan of slow statement %s:\n%s", shape, plan)
+
+    def _should_explain(self, database, sql, shape):
+        if self.explain_limit == 0:
+            return False
+
+        statement = sql.lstrip().split(None, 1)[0].upper() if len(sql.strip()) > 0 else ""
+
+        # only plain queries can be explained, i.e. not the DDL and COPY run by migrations and recounts
+        if statement not in _EXPLAINABLE:
+            return False
+
+        if database.connection.autocommit and statement != "SELECT":
+            return False
+
+        with self._lock:
+            explained = self._explained.get(shape, 0)
+            if explained >= self.explain_limit:
+                return False
+
+            self._explained[shape] = explained + 1
+
+        return True
+
+    @staticmethod
+    def _explain(database, sql, values, shape):
+        sql = "EXPLAIN (ANALYZE, BUFFERS) " + sql
+        savepoint = not database.connection.autocommit
+
+        cursor = database.connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT {}".format(EXPLAIN_SAVEPOINT))
+
+            try:
+                if values:
+                    cursor.execute(sql, values)
+                else:
+                    cursor.execute(sql)
+
+                return "\n".join(row[0] for row in cursor.fetchall())
+            except Exception:
+                log.exception("Failed to explain statement %s", shape)
+                return None
+            finally:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT {}".format(EXPLAIN_SAVEPOINT))
+                    cursor.execute("RELEASE SAVEPOINT {}".format(EXPLAIN_SAVEPOINT))
+        finally:
+            cursor.close()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+import io
+
+from .conditionals import ILike
+from .database import Count, _DerivedTable
+from .rollups import rebuild_rollups
+from .tables import CHANNEL_PHRASE_COUNTS, CHANNELS, GUILD_PHRASE_COUNTS, MESSAGE_CONTENT, MESSAGES, PHRASES, \
+    REMOVED_PHRASES, USER_MATCHED_PHRASES
+
+RECOUNT_STAGING = "recount_matches"
+RECOUNT_MESSAGES = "recount_messages"
+RECOUNT_STAGING_COLUMNS = ("message_content_id", "phrase_id", "matches")
+
+
+def stage_recount_messages(database, guild_id):
+    """
+    Snapshots the guild's currently stored messages into a temporary table, dropped again when the transaction ends.
+    The recount only matches and replaces the rows of these messages, so messages ingested while it runs, live or
+    backfilled, keep their rows.
+
+    :param database: Current active database connection.
+    :param guild_id: Guild to recount.
+    :return: Number of distinct message contents of the snapshotted messages.
+    """
+    database.executeSql("CREATE TEMPORARY TABLE \"{recount_messages}\" ON COMMIT DROP AS "
+                        "SELECT m.\"{uid}\",m.\"{user_id}\",m.\"{channel_id}\",m.\"{content_id}\" FROM \"{messages}\" m "
+                        "JOIN \"{channels}\" c ON c.\"{channel_uid}\" = m.\"{channel_id}\" WHERE c.\"{guild_id}\" = %(guild_id)s".format(
+                            recount_messages=RECOUNT_MESSAGES, messages=MESSAGES.name, uid=MESSAGES.UID,
+                            user_id=MESSAGES.USER_ID, channel_id=MESSAGES.CHANNEL_ID, content_id=MESSAGES.MESSAGE_CONTENT_ID,
+                            channels=CHANNELS.name, channel_uid=CHANNELS.UID, guild_id=CHANNELS.GUILD_ID),
+                        {'guild_id': guild_id})
+
+    # temporary tables are never analyzed automatically, without statistics the swap joins are planned blind
+    database.executeSql("ANALYZE \"{recount_messages}\"".format(recount_messages=RECOUNT_MESSAGES))
+
+    database.executeSql("SELECT COUNT(DISTINCT \"{content_id}\") FROM \"{recount_messages}\"".format(
+        content_id=MESSAGES.MESSAGE_CONTENT_ID, recount_messages=RECOUNT_MESSAGES))
+
+    return database.cursor.fetchone()[0]
+
+
+def select_guild_contents(database):
+    """
+    Builds the query of every distinct message content of the messages snapshotted by stage_recount_messages. Meant to
+    be streamed with fetchiter.
+
+    :return: Select query returning the id and content columns of message_content.
+    """
+    sql = "SELECT \"{id}\",\"{content}\" FROM \"{message_content}\" " \
+          "WHERE \"{id}\" IN (SELECT \"{content_id}\" FROM \"{recount_messages}\")".format(
+              id=MESSAGE_CONTENT.ID, content=MESSAGE_CONTENT.CONTENT, message_content=MESSAGE_CONTENT.name,
+              content_id=MESSAGES.MESSAGE_CONTENT_ID, recount_messages=RECOUNT_MESSAGES)
+
+    guild_contents = _DerivedTable("guild_contents", [MESSAGE_CONTENT.ID, MESSAGE_CONTENT.CONTENT], sql, {})
+
+    return database.select(MESSAGE_CONTENT.ID, MESSAGE_CONTENT.CONTENT).FROM(guild_contents)
+
+
+def create_recount_staging(database):
+    """
+    Creates the staging table recounted matches are copied into, dropped again when the transaction ends.
+    """
+    database.executeSql("CREATE TEMPORARY TABLE \"{staging}\" (\"{content_id}\" integer NOT NULL, "
+                        "\"{phrase_id}\" integer NOT NULL, \"{matches}\" integer NOT NULL) ON COMMIT DROP".format(
+                            staging=RECOUNT_STAGING, content_id=RECOUNT_STAGING_COLUMNS[0],
+                            phrase_id=RECOUNT_STAGING_COLUMNS[1], matches=RECOUNT_STAGING_COLUMNS[2]))
+
+def stage_recount_matches(database, rows):
+    """
+    Bulk copies matches into the staging table.
+
+    :param database: Current active database connection.
+    :param rows: Array of (message_content_id, phrase_id, matches).
+    """
+    if len(rows) == 0:
+        return
+
+    buffer = io.StringIO("".join("{}\t{}\t{}\n".format(*row) for row in rows))
+    database.cursor.copy_from(buffer, RECOUNT_STAGING, columns=RECOUNT_STAGING_COLUMNS)
+
+
+def swap_recount_matches(database, guild_id):
+    """
+    Replaces the user_matched_phrases rows of the messages snapshotted by stage_recount_messages with the staged
+    matches and rebuilds the guild's rollups. Needs to run in the transaction that staged the matches, readers keep
+    seeing the old counts until it is committed.
+
+    Messages ingested after the snapshot was taken were never matched by the recount, their rows are left untouched.
+    Staged matches of phrases removed since the recount started are dropped.
+    """
+    ump = USER_MATCHED_PHRASES
+
+    params = {'guild_id': guild_id}
+
+    database.executeSql("DELETE FROM \"{ump}\" WHERE \"{guild_id}\" = %(guild_id)s "
+                        "AND \"{message_id}\" IN (SELECT \"{uid}\" FROM \"{recount_messages}\")".format(
+                            ump=ump.name, guild_id=ump.GUILD_ID, message_id=ump.MESSAGE_ID, uid=MESSAGES.UID,
+                            recount_messages=RECOUNT_MESSAGES),
+                        params)
+
+    database.executeSql("INSERT INTO \"{ump}\" (\"{phrase_id}\",\"{user_id}\",\"{guild_id}\",\"{channel_id}\",\"{message_id}\",\"{matches}\") "
+                        "SELECT r.\"{staged_phrase_id}\",s.\"{message_user_id}\",%(guild_id)s,s.\"{message_channel_id}\","
+                        "s.\"{message_uid}\",r.\"{staged_matches}\" FROM \"{staging}\" r "
+                        "JOIN \"{recount_messages}\" s ON s.\"{message_content_id}\" = r.\"{staged_content_id}\" "
+                        "JOIN \"{phrases}\" p ON p.\"{phrase_uid}\" = r.\"{staged_phrase_id}\" "
+                        "ON CONFLICT (\"{message_id}\",\"{phrase_id}\") DO NOTHING".format(
+                            ump=ump.name, phrase_id=ump.PHRASE_ID, user_id=ump.USER_ID, guild_id=ump.GUILD_ID,
+                            channel_id=ump.CHANNEL_ID, message_id=ump.MESSAGE_ID, matches=ump.MATCHES,
+                            staging=RECOUNT_STAGING, staged_content_id=RECOUNT_STAGING_COLUMNS[0],
+                            staged_phrase_id=RECOUNT_STAGING_COLUMNS[1], staged_matches=RECOUNT_STAGING_COLUMNS[2],
+                            recount_messages=RECOUNT_MESSAGES, message_uid=MESSAGES.UID, message_user_id=MESSAGES.USER_ID,
+                            message_channel_id=MESSAGES.CHANNEL_ID, message_content_id=MESSAGES.MESSAGE_CONTENT_ID,
+                            phrases=PHRASES.name, phrase_uid=PHRASES.ID),
+                        params)
+
+    rebuild_rollups(database, guild_id)
+
+
+def phrase_candidate_pattern(phrase):
+    """
+    Single word phrases are counted as plain substrings of the lowered content, so only contents containing the phrase
+    can match and an ILIKE pattern, backed by the trigram index on the content, finds every candidate. Multi word
+    phrases are fuzzy matched and can't be pre-filtered.
+
+    :return: ILIKE pattern of the phrase's candidate contents, None if every content is a candidate.
+    """
+    phrase = phrase.lower()
+
+    if len(phrase.split(" ")) != 1:
+        return None
+
+    return "%{}%".format(phrase.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"))
+
+
+def count_phrase_candidates(database, pattern):
+    """
+    :param pattern: ILIKE pattern from phrase_candidate_pattern, None to count every message content.
+    :return: Number of message contents matching the pattern.
+    """
+    query = database.select(Count(MESSAGE_CONTENT.ID)).FROM(MESSAGE_CONTENT)
+
+    if pattern is not None:
+        query = query.WHERE(ILike(MESSAGE_CONTENT.CONTENT, pattern))
+
+    return query.fetchone()
+
+
+def select_phrase_candidates(database, pattern):
+    """
+    Builds the query of every message content matching the pattern. Meant to be streamed with fetchiter.
+
+    :param pattern: ILIKE pattern from phrase_candidate_pattern, None to select every message content.
+    :return: Select query returning the id and content columns of message_content.
+    """
+    query = database.select(MESSAGE_CONTENT.ID, MESSAGE_CONTENT.CONTENT).FROM(MESSAGE_CONTENT)
+
+    if pattern is not None:
+        query = query.WHERE(ILike(MESSAGE_CONTENT.CONTENT, pattern))
+
+    return query
+
+
+def apply_staged_matches(database):
+    """
+    Adds the staged matches of every guild's messages to user_matched_phrases, and increments the rollups by the rows
+    that were actually inserted, in a single statement. Rows ingested concurrently for the same message and phrase are
+    kept and never counted twice, and staged matches of phrases removed since the count started are dropped.
+    """
+    ump = USER_MATCHED_PHRASES
+
+    rollup_sql = "INSERT INTO \"{rollup}\" (\"{scope}\",\"{user_id}\",\"{phrase_id}\",\"{matches}\") " \
+                 "SELECT \"{scope}\",\"{user_id}\",\"{phrase_id}\",SUM(\"{matches}\") FROM inserted " \
+                 "GROUP BY \"{scope}\",\"{user_id}\",\"{phrase_id}\" ON CONFLICT (\"{scope}\",\"{user_id}\",\"{phrase_id}\") " \
+                 "DO UPDATE SET \"{matches}\" = \"{rollup}\".\"{matches}\" + EXCLUDED.\"{matches}\""
+
+    # inserted returns the user_matched_phrases columns, whose names the rollups share
+    insert_sql = "WITH inserted AS (INSERT INTO \"{ump}\" (\"{phrase_id}\",\"{user_id}\",\"{guild_id}\",\"{channel_id}\"," \
+                 "\"{message_id}\",\"{matches}\") " \
+                 "SELECT r.\"{staged_phrase_id}\",m.\"{message_user_id}\",c.\"{channel_guild_id}\",m.\"{message_channel_id}\"," \
+                 "m.\"{message_uid}\",r.\"{staged_matches}\" FROM \"{staging}\" r " \
+                 "JOIN \"{messages}\" m ON m.\"{message_content_id}\" = r.\"{staged_content_id}\" " \
+                 "JOIN \"{channels}\" c ON c.\"{channel_uid}\" = m.\"{message_channel_id}\" " \
+                 "JOIN \"{phrases}\" p ON p.\"{phrase_uid}\" = r.\"{staged_phrase_id}\" " \
+                 "ON CONFLICT (\"{message_id}\",\"{phrase_id}\") DO NOTHING " \
+                 "RETURNING \"{phrase_id}\",\"{user_id}\",\"{guild_id}\",\"{channel_id}\",\"{matches}\")".format(
+                     ump=ump.name, phrase_id=ump.PHRASE_ID, user_id=ump.USER_ID, guild_id=ump.GUILD_ID,
+                     channel_id=ump.CHANNEL_ID, message_id=ump.MESSAGE_ID, matches=ump.MATCHES,
+                     staging=RECOUNT_STAGING, staged_content_id=RECOUNT_STAGING_COLUMNS[0],
+                     staged_phrase_id=RECOUNT_STAGING_COLUMNS[1], staged_matches=RECOUNT_STAGING_COLUMNS[2],
+                     messages=MESSAGES.name, message_uid=MESSAGES.UID, message_user_id=MESSAGES.USER_ID,
+                     message_channel_id=MESSAGES.CHANNEL_ID, message_content_id=MESSAGES.MESSAGE_CONTENT_ID,
+                     channels=CHANNELS.name, channel_uid=CHANNELS.UID, channel_guild_id=CHANNELS.GUILD_ID,
+                     phrases=PHRASES.name, phrase_uid=PHRASES.ID)
+
+    guild_rollup_sql = rollup_sql.format(rollup=GUILD_PHRASE_COUNTS.name, scope=GUILD_PHRASE_COUNTS.GUILD_ID,
+                                         user_id=GUILD_PHRASE_COUNTS.USER_ID, phrase_id=GUILD_PHRASE_COUNTS.PHRASE_ID,
+                                         matches=GUILD_PHRASE_COUNTS.MATCHES)
+
+    channel_rollup_sql = rollup_sql.format(rollup=CHANNEL_PHRASE_COUNTS.name, scope=CHANNEL_PHRASE_COUNTS.CHANNEL_ID,
+                                           user_id=CHANNEL_PHRASE_COUNTS.USER_ID, phrase_id=CHANNEL_PHRASE_COUNTS.PHRASE_ID,
+                                           matches=CHANNEL_PHRASE_COUNTS.MATCHES)
+
+    database.executeSql("{}, guild_rollup AS ({}) {}".format(insert_sql, guild_rollup_sql, channel_rollup_sql))
+
+def delete_phrase(database, phrase_id):
+    """
+    Removes a phrase together with its user_matched_phrases and rollup rows, and records the removal in removed_phrases
+    so the phrase isn't tracked again from the config.
+    """
+    params = {'phrase_id': phrase_id}
+
+    database.executeSql("INSERT INTO \"{removed_phrases}\" (\"{removed_phrase}\") SELECT \"{phrase}\" FROM \"{phrases}\" "
+                        "WHERE \"{id}\" = %(phrase_id)s ON CONFLICT (\"{removed_phrase}\") DO NOTHING".format(
+                            removed_phrases=REMOVED_PHRASES.name, removed_phrase=REMOVED_PHRASES.PHRASE,
+                            phrases=PHRASES.name, phrase=PHRASES.PHRASE, id=PHRASES.ID),
+                        params)
+
+    for table in [USER_MATCHED_PHRASES, GUILD_PHRASE_COUNTS, CHANNEL_PHRASE_COUNTS]:
+        database.executeSql("DELETE FROM \"{table}\" WHERE \"{phrase_id}\" = %(phrase_id)s".format(
+            table=table.name, phrase_id=table.PHRASE_ID), params)
+
+    database.executeSql("DELETE FROM \"{phrases}\" WHERE \"{id}\" = %(phrase_id)s".format(phrases=PHRASES.name, id=PHRASES.ID),
+                        params)
+
+
+def restore_phrase(database, phrase):
+    """
+    Forgets an earlier removal of phrase, i.e. when it is added again at runtime.
+    """
+    database.executeSql("DELETE FROM \"{removed_phrases}\" WHERE \"{phrase}\" = %(phrase)s".format(
+        removed_phrases=REMOVED_PHRASES.name, phrase=REMOVED_PHRASES.PHRASE), {'phrase': phrase})
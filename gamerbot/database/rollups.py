@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+from .functions import increment_counts
+from .tables import CHANNEL_PHRASE_COUNTS, CHANNELS, GUILD_PHRASE_COUNTS, USER_MATCHED_PHRASES
+
+
+def increment_rollups(database, matched_rows):
+    """
+    Adds newly ingested user_matched_phrases rows onto the guild and channel rollups. Needs to run in the same
+    transaction as the ingestion so the rollups never drift from the raw table.
+
+    :param database: Current active database connection.
+    :param matched_rows: Inserted user_matched_phrases rows, holding at least the phrase, user, guild, channel and
+        matches columns.
+    """
+    guild_counts = {}
+    channel_counts = {}
+
+    for row in matched_rows:
+        guild_key = (row[USER_MATCHED_PHRASES.GUILD_ID], row[USER_MATCHED_PHRASES.USER_ID], row[USER_MATCHED_PHRASES.PHRASE_ID])
+        channel_key = (row[USER_MATCHED_PHRASES.CHANNEL_ID], row[USER_MATCHED_PHRASES.USER_ID], row[USER_MATCHED_PHRASES.PHRASE_ID])
+
+        guild_counts[guild_key] = guild_counts.get(guild_key, 0) + row[USER_MATCHED_PHRASES.MATCHES]
+        channel_counts[channel_key] = channel_counts.get(channel_key, 0) + row[USER_MATCHED_PHRASES.MATCHES]
+
+    increment_counts(database, GUILD_PHRASE_COUNTS, [GUILD_PHRASE_COUNTS.GUILD_ID, GUILD_PHRASE_COUNTS.USER_ID,
+                                                     GUILD_PHRASE_COUNTS.PHRASE_ID], GUILD_PHRASE_COUNTS.MATCHES, guild_counts)
+
+    increment_counts(database, CHANNEL_PHRASE_COUNTS, [CHANNEL_PHRASE_COUNTS.CHANNEL_ID, CHANNEL_PHRASE_COUNTS.USER_ID,
+                                                       CHANNEL_PHRASE_COUNTS.PHRASE_ID], CHANNEL_PHRASE_COUNTS.MATCHES, channel_counts)
+
+
+def rebuild_rollups(database, guild_id=None):
+    """
+    Regenerates the guild and channel rollups from user_matched_phrases, e.g. after a recount.
+
+    :param database: Current active database connection.
+    :param guild_id: Only rebuild the rollups of this guild and its channels, None to rebuild everything.
+    """
+    ump = USER_MATCHED_PHRASES
+
+    guild_filter = "" if guild_id is None else " WHERE \"{}\" = %(guild_id)s".format(ump.GUILD_ID)
+    channel_filter = "" if guild_id is None else " WHERE \"{}\" IN (SELECT \"{}\" FROM \"{}\" WHERE \"{}\" = %(guild_id)s)".format(
+        CHANNEL_PHRASE_COUNTS.CHANNEL_ID, CHANNELS.UID, CHANNELS.name, CHANNELS.GUILD_ID)
+
+    params = {'guild_id': guild_id}
+
+    database.executeSql("DELETE FROM \"{}\"{}".format(GUILD_PHRASE_COUNTS.name, guild_filter), params)
+    database.executeSql("INSERT INTO \"{0}\" (\"{1}\",\"{2}\",\"{3}\",\"{4}\") "
+                        "SELECT \"{1}\",\"{2}\",\"{3}\",SUM(\"{4}\") FROM \"{5}\"{6} GROUP BY \"{1}\",\"{2}\",\"{3}\"".format(
+                            GUILD_PHRASE_COUNTS.name, ump.GUILD_ID, ump.USER_ID, ump.PHRASE_ID, ump.MATCHES, ump.name, guild_filter),
+                        params)
+
+    database.executeSql("DELETE FROM \"{}\"{}".format(CHANNEL_PHRASE_COUNTS.name, channel_filter), params)
+    database.executeSql("INSERT INTO \"{0}\" (\"{1}\",\"{2}\",\"{3}\",\"{4}\") "
+                        "SELECT \"{1}\",\"{2}\",\"{3}\",SUM(\"{4}\") FROM \"{5}\"{6} GROUP BY \"{1}\",\"{2}\",\"{3}\"".format(
+                            CHANNEL_PHRASE_COUNTS.name, ump.CHANNEL_ID, ump.USER_ID, ump.PHRASE_ID, ump.MATCHES, ump.name, guild_filter),
+                        params)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+import hashlib
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+_PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s")
+
+# IS, IS NOT, IN and NOT IN take keywords or value lists, which can't be bound to a single prepared statement parameter
+_UNPREPARABLE = re.compile(r"\b(?:IS(?:\s+NOT)?|IN)\s*$", re.IGNORECASE)
+
+
+class _CompiledStatement(object):
+    def __init__(self, name, prepare_sql, execute_sql, parameters):
+        self.name = name
+        self.prepare_sql = prepare_sql
+        self.execute_sql = execute_sql
+        self.parameters = parameters
+
+
+class StatementCache(object):
+    """
+    Executes builder statements through server side prepared statements, so Postgres only parses and plans each
+    statement shape once per connection.
+
+    The shape of a statement is its SQL with %(name)s placeholders, which the builder generates deterministically for
+    a given chain of calls, so it doubles as the statement's fingerprint. The compiled PREPARE/EXECUTE pair of each
+    shape is cached, and the statements prepared on each connection are tracked until the connection is garbage
+    collected.
+    """
+    def __init__(self, max_size=256):
+        """
+        :param max_size: Maximum number of compiled statement shapes kept in memory.
+        """
+        self.max_size = max_size
+
+        self._compiled = OrderedDict() # sql: _CompiledStatement, None for statements that can't be prepared
+        self._prepared = weakref.WeakKeyDictionary() # connection: set of prepared statement names
+        self._lock = threading.Lock()
+
+    def execute(self, connection, cursor, sql, values):
+        """
+        Executes sql with its values on cursor, preparing the statement on connection first if needed.
+
+        :param connection: Connection the cursor belongs to.
+        :param cursor: Cursor to execute on.
+        :param sql: Statement with %(name)s placeholders.
+        :param values: Dictionary of placeholder name:value.
+        """
+        statement = self.compile(sql)
+
+        if statement is None:
+            cursor.execute(sql, values)
+            return
+
+        with self._lock:
+            prepared = self._prepared.setdefault(connection, set())
+
+        if statement.name not in prepared:
+            cursor.execute(statement.prepare_sql)
+            prepared.add(statement.name)
+
+        cursor.execute(statement.execute_sql, [values[parameter] for parameter in statement.parameters])
+
+    def compile(self, sql):
+        """
+        :return: The compiled statement for sql, None if sql can't be prepared.
+        """
+        with self._lock:
+            if sql in self._compiled:
+                self._compiled.move_to_end(sql)
+                return self._compiled[sql]
+
+        statement = self._compile(sql)
+
+        with self._lock:
+            self._compiled[sql] = statement
+
+            while len(self._compiled) > self.max_size:
+                self._compiled.popitem(last=False)
+
+        return statement
+
+    def forget(self, connection):
+        """
+        Stops tracking the statements prepared on connection, i.e. after DEALLOCATE ALL or a reconnect.
+        """
+        with self._lock:
+            self._prepared.pop(connection, None)
+
+    @staticmethod
+    def _compile(sql):
+        parameters = []
+        indexes = {}
+        preparable = True
+
+        def replace(match):
+            nonlocal preparable
+
+            if match.group(0) == "%%":
+                return "%"
+
+            if _UNPREPARABLE.search(sql, 0, match.start()):
+                preparable = False
+
+            name = match.group(1)
+            if name not in indexes:
+                parameters.append(name)
+                indexes[name] = len(parameters)
+
+            return "${}".format(indexes[name])
+
+        prepared_sql = _PLACEHOLDER.sub(replace, sql)
+
+        if not preparable or len(parameters) == 0:
+            return None
+
+        name = "gamerbot_{}".format(hashlib.sha1(sql.encode("utf-8")).hexdigest()[:16])
+
+        return _CompiledStatement(name, "PREPARE {} AS {}".format(name, prepared_sql),
+                                  "EXECUTE {} ({})".format(name, ",".join(["%s"] * len(parameters))), parameters)
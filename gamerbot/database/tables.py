@@ -9,14 +9,25 @@
 
 
 class _TABLE(object):
+    """
+    Immutable schema metadata. Columns are ordered tuples, and column_set is derived from them for O(1) validation.
+    """
     name = "TABLE"
-    columns = []
-    non_pk_columns = []
+    columns = ()
+    non_pk_columns = ()
+    column_set = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls.columns = tuple(cls.columns)
+        cls.non_pk_columns = tuple(cls.non_pk_columns)
+        cls.column_set = frozenset(cls.columns)
 
 
 class CHANNELS(_TABLE):
     name = "channels"
-    columns = ["uid", "guild_id", "channel_name_id"]
+    columns = ("uid", "guild_id", "channel_name_id")
     non_pk_columns = columns[1:]
 
     UID = "uid"
@@ -24,18 +35,38 @@ class CHANNELS(_TABLE):
     CHANNEL_NAME_ID = "channel_name_id"
 
 
+class CHANNEL_BACKFILL(_TABLE):
+    name = "channel_backfill"
+    columns = ("channel_id", "last_message_uid")
+    non_pk_columns = columns[1:]
+
+    CHANNEL_ID = "channel_id"
+    LAST_MESSAGE_UID = "last_message_uid"
+
+
 class CHANNEL_NAMES(_TABLE):
     name = "channel_names"
-    columns = ["id", "channel_name"]
+    columns = ("id", "channel_name")
     non_pk_columns = columns[1:]
 
     ID = "id"
     CHANNEL_NAME = "channel_name"
 
 
+class CHANNEL_PHRASE_COUNTS(_TABLE):
+    name = "channel_phrase_counts"
+    columns = ("channel_id", "user_id", "phrase_id", "matches")
+    non_pk_columns = columns[3:]
+
+    CHANNEL_ID = "channel_id"
+    USER_ID = "user_id"
+    PHRASE_ID = "phrase_id"
+    MATCHES = "matches"
+
+
 class GUILDS(_TABLE):
     name = "guilds"
-    columns = ["uid", "guild_name_id"]
+    columns = ("uid", "guild_name_id")
     non_pk_columns = columns[1:]
 
     UID = "uid"
@@ -44,16 +75,27 @@ class GUILDS(_TABLE):
 
 class GUILD_NAMES(_TABLE):
     name = "guild_names"
-    columns = ["id", "guild_name"]
+    columns = ("id", "guild_name")
     non_pk_columns = columns[1:]
 
     ID = "id"
     GUILD_NAME = "guild_name"
 
 
+class GUILD_PHRASE_COUNTS(_TABLE):
+    name = "guild_phrase_counts"
+    columns = ("guild_id", "user_id", "phrase_id", "matches")
+    non_pk_columns = columns[3:]
+
+    GUILD_ID = "guild_id"
+    USER_ID = "user_id"
+    PHRASE_ID = "phrase_id"
+    MATCHES = "matches"
+
+
 class MESSAGES(_TABLE):
     name = "messages"
-    columns = ["uid", "user_id", "channel_id", "message_content_id", "created_at"]
+    columns = ("uid", "user_id", "channel_id", "message_content_id", "created_at")
     non_pk_columns = columns[1:]
 
     UID = "uid"
@@ -65,25 +107,44 @@ class MESSAGES(_TABLE):
 
 class MESSAGE_CONTENT(_TABLE):
     name = "message_content"
-    columns = ["id", "content"]
+    columns = ("id", "content", "digest")
     non_pk_columns = columns[1:]
 
     ID = "id"
     CONTENT= "content"
+    DIGEST = "digest"
 
 
 class PHRASES(_TABLE):
     name = "phrases"
-    columns = ["id", "phrase"]
+    columns = ("id", "phrase")
     non_pk_columns = columns[1:]
 
     ID = "id"
     PHRASE = "phrase"
 
 
+class REMOVED_PHRASES(_TABLE):
+    name = "removed_phrases"
+    columns = ("phrase",)
+    non_pk_columns = ()
+
+    PHRASE = "phrase"
+
+
+class SCHEMA_MIGRATIONS(_TABLE):
+    name = "schema_migrations"
+    columns = ("version", "description", "applied_at")
+    non_pk_columns = columns[1:]
+
+    VERSION = "version"
+    DESCRIPTION = "description"
+    APPLIED_AT = "applied_at"
+
+
 class USERS(_TABLE):
     name = "users"
-    columns = ["uid", "user_name_id"]
+    columns = ("uid", "user_name_id")
     non_pk_columns = columns[1:]
 
     UID = "uid"
@@ -92,7 +153,7 @@ class USERS(_TABLE):
 
 class USER_NAMES(_TABLE):
     name = "user_names"
-    columns = ["id", "user_name"]
+    columns = ("id", "user_name")
     non_pk_columns = columns[1:]
 
     ID = "id"
@@ -101,7 +162,7 @@ class USER_NAMES(_TABLE):
 
 class USER_MATCHED_PHRASES(_TABLE):
     name = "user_matched_phrases"
-    columns = ["id", "phrase_id", "user_id", "guild_id", "channel_id", "message_id", "matches"]
+    columns = ("id", "phrase_id", "user_id", "guild_id", "channel_id", "message_id", "matches")
     non_pk_columns = columns[1:]
 
     ID = "id"
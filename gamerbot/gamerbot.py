@@ -1,12 +1,33 @@
+import asyncio
+import configparser
+import datetime
+import logging
+
 import discord
 
 from sigmod_fingerprinting.fingerprint import Fingerprint
-from .database.conditionals import Eq
-from .database.database import Database, Sum
-from .database.functions import ingest_if_not_exist_returning, fetchone_from_table
-from .database.ordering import Desc
+from .database.backfill import seed_backfill_checkpoints
+from .database.conditionals import Eq, In, Lt, Lte
+from .database.database import Database, DenseRank, RowNumber, Sum, SumOver
+from .database.functions import content_digest, fetch_name_lookup_table, insert_if_not_exist, sync_name_lookup_table, \
+    upsert_many_returning, upsert_returning
+from .database.migrations import ensure_trigram_index, migrate
+from .database.ordering import Asc, Desc
+from .database.partitions import ensure_partitions, snowflake_at
+from .database.profiling import SlowQueryLog
+from .database.recount import delete_phrase, restore_phrase
+from .database.rollups import increment_rollups
 from .database.tables import *
-from .util.fingerprint import template_match_fingerprints
+from .recount import RecountEngine
+from .util.backfill import BackfillScheduler, RateLimiter
+from .util.batch_queue import BatchQueue
+from .util.lru_cache import LRUCache
+from .util.matcher import PhraseMatcher
+from .util.metrics import MetricsRegistry, MetricsServer
+from .util.result_cache import ResultCache
+from .util.shared_lock import SharedLock
+
+log = logging.getLogger(__name__)
 
 
 class GamerBot(discord.AutoShardedClient):
@@ -14,6 +35,12 @@ class GamerBot(discord.AutoShardedClient):
     command_trigger = "gs!"
     help_trigger = "!help"
 
+    # number of messages discord returns per history request
+    history_page_size = 100
+
+    # seconds between checks that next year's partitions exist
+    partition_check_interval = 24 * 60 * 60
+
     commands = {
         "": {'msg': "Display the overall stats for the server.", 'super': False},
         "user": {'msg': "Display the stats for mentioned users.", 'super': False},
@@ -25,89 +52,256 @@ class GamerBot(discord.AutoShardedClient):
         "help": {'msg': "Display help", 'super': False}
     }
 
-    def __init__(self, connection, phrases, loop=None, **options):
+    def __init__(self, db_pool, phrases, config=None, loop=None, **options):
         super().__init__(loop=loop, options=options)
         self.phrase_dict = {}
-        self.percent_match = .9
+
+        # messages from before this snowflake can't have come from this process' live ingestion
+        self.started_uid = snowflake_at(datetime.datetime.utcnow())
+
+        if config is None:
+            config = configparser.ConfigParser()
 
         self.fingerprint = Fingerprint()
 
-        self.db_connection = connection
+        self.db_pool = db_pool
+        self._migrate_schema()
+        self._partition_task = None
+
+        self.phrase_matcher = PhraseMatcher({}, self.fingerprint)
         self._ingest_phrases(phrases)
 
+        # writes of phrase matches hold the lock shared, removing a phrase holds it exclusively so no match of the
+        # removed phrase can be written alongside or after its delete
+        self.phrase_lock = SharedLock()
+
+        self.ingest_queue = BatchQueue(self._flush_messages,
+                                       flush_size=config.getint("Ingest", "flush_size", fallback=100),
+                                       flush_interval=config.getint("Ingest", "flush_interval_ms", fallback=500) / 1000,
+                                       max_depth=config.getint("Ingest", "queue_depth", fallback=10000),
+                                       retries=config.getint("Ingest", "flush_retries", fallback=2),
+                                       retry_delay=config.getint("Ingest", "flush_retry_delay_ms", fallback=500) / 1000)
+
+        # repeated contents (emotes, "gg", copypastas) resolve their message_content id without a database lookup
+        self.content_id_cache = LRUCache(max_size=config.getint("Ingest", "content_cache_size", fallback=100000))
+
+        # uid:(name, name_id) of the rows known to be in sync with the database, lookups with an unchanged name are skipped
+        name_cache_size = config.getint("Ingest", "name_cache_size", fallback=50000)
+        self.user_cache = LRUCache(max_size=name_cache_size)
+        self.guild_cache = LRUCache(max_size=name_cache_size)
+        self.channel_cache = LRUCache(max_size=name_cache_size)
+        self._warm_name_caches()
+
+        self.stats_cache = ResultCache(max_size=config.getint("Stats", "cache_size", fallback=256),
+                                       ttl=config.getint("Stats", "cache_ttl", fallback=30))
+
+        self.backfill_chunk_size = config.getint("Backfill", "chunk_size", fallback=500)
+        self.backfill_scheduler = BackfillScheduler(self._ingest_channel_history,
+                                                    concurrency=config.getint("Backfill", "concurrency", fallback=4),
+                                                    rate_limiter=RateLimiter(config.getfloat("Backfill", "channel_requests_per_second", fallback=1.0),
+                                                                             config.getfloat("Backfill", "requests_per_second", fallback=40.0)),
+                                                    progress_interval=config.getint("Backfill", "progress_interval", fallback=30))
+
+        self.recount_engine = RecountEngine(db_pool, Fingerprint, phrase_lock=self.phrase_lock,
+                                            workers=config.getint("Recount", "workers", fallback=0) or None,
+                                            chunk_size=config.getint("Recount", "chunk_size", fallback=2000),
+                                            progress_interval=config.getint("Recount", "progress_interval", fallback=10))
+
+        self._setup_metrics(config)
+
+        # opt-in, statements over the threshold are logged with their SQL and optionally their plan
+        slow_query_ms = config.getint("Profiling", "slow_query_ms", fallback=0)
+        if slow_query_ms > 0:
+            Database.slow_query_log = SlowQueryLog(threshold_ms=slow_query_ms,
+                                                   explain_limit=config.getint("Profiling", "explain_limit", fallback=0))
+
+    def _setup_metrics(self, config):
+        """
+        Registers the bot's metrics, only served and recorded when [Metrics] enabled is set. Disabled metrics are never
+        observed, their calls return right away.
+        """
+        enabled = config.getboolean("Metrics", "enabled", fallback=False)
+
+        self.metrics = MetricsRegistry(enabled=enabled)
+        self.metrics_server = None
+
+        self.stage_seconds = self.metrics.histogram("gamerbot_stage_seconds", "Seconds spent per processing stage.", ["stage"])
+        self.command_seconds = self.metrics.histogram("gamerbot_command_seconds", "Seconds spent answering a command.", ["command"])
+        self.messages_processed = self.metrics.counter("gamerbot_messages_processed_total", "Messages matched and ingested.")
+        self.phrase_matches = self.metrics.counter("gamerbot_phrase_matches_total", "Phrase matches of newly stored messages.")
+        self.metrics.gauge("gamerbot_ingest_queue_depth", "Messages waiting to be ingested.", self.ingest_queue.qsize)
+
+        if enabled:
+            Database.statement_seconds = self.metrics.histogram("gamerbot_statement_seconds", "Seconds spent executing a statement.",
+                                                                ["statement"])
+
+            self.metrics_server = MetricsServer(self.metrics,
+                                                host=config.get("Metrics", "host", fallback="127.0.0.1"),
+                                                port=config.getint("Metrics", "port", fallback=9100))
+
+    def _migrate_schema(self):
+        with self.db_pool.database() as db:
+            migrate(db)
+            ensure_partitions(db)
+            ensure_trigram_index(db)
+            db.commit()
+
+    async def _maintain_partitions(self):
+        while True:
+            await asyncio.sleep(self.partition_check_interval)
+
+            try:
+                async with self.db_pool.acquire() as db:
+                    await db.run(ensure_partitions)
+                    await db.commit()
+            except Exception:
+                log.exception("Failed to create the upcoming partitions.")
 
     def _ingest_phrases(self, phrases):
-        db = Database(self.db_connection)
+        phrase_dict = {}
+
+        with self.db_pool.database() as db:
+            # track every stored phrase, not only the configured ones, so phrases added at runtime survive restarts
+            for row in db.selectFrom(PHRASES).fetchall():
+                phrase_dict[row[PHRASES.ID]] = row[PHRASES.PHRASE]
 
-        for phrase in phrases:
-            phrase_id = ingest_if_not_exist_returning(db, PHRASES, {PHRASES.PHRASE:phrase.lower()}, [PHRASES.ID])
-            self.phrase_dict[phrase_id] = phrase
+            # configured phrases removed at runtime stay removed until they are added again
+            removed_phrases = set(db.selectFrom(REMOVED_PHRASES).fetchall())
 
-        self.db_connection.commit()
+            for phrase in phrases:
+                if phrase.lower() in removed_phrases:
+                    continue
 
-    def _get_matched_phrase_ids(self, content, db):
-        content = content.lower()
+                phrase_id = upsert_returning(db, PHRASES, {PHRASES.PHRASE:phrase.lower()}, [PHRASES.ID])
+                phrase_dict[phrase_id] = phrase
 
-        phrases = db.selectFrom(PHRASES).fetchall()
+            db.commit()
 
-        matched = {}
+        self._set_phrases(phrase_dict)
 
-        for phrase_dict in phrases:
-            phrase_id = phrase_dict[PHRASES.ID]
-            phrase = phrase_dict[PHRASES.PHRASE]
+    def _warm_name_caches(self):
+        with self.db_pool.database() as db:
+            self.user_cache.update(fetch_name_lookup_table(db, USERS, USERS.UID, USERS.USER_NAME_ID, USER_NAMES, USER_NAMES.USER_NAME,
+                                                           self.user_cache.max_size))
+            self.guild_cache.update(fetch_name_lookup_table(db, GUILDS, GUILDS.UID, GUILDS.GUILD_NAME_ID, GUILD_NAMES, GUILD_NAMES.GUILD_NAME,
+                                                            self.guild_cache.max_size))
+            self.channel_cache.update(fetch_name_lookup_table(db, CHANNELS, CHANNELS.UID, CHANNELS.CHANNEL_NAME_ID, CHANNEL_NAMES,
+                                                              CHANNEL_NAMES.CHANNEL_NAME, self.channel_cache.max_size))
 
-            # single word phrases look for a direct match
-            if len(phrase.split(" ")) == 1:
-                count = content.count(phrase)
-                if count > 0:
-                    matched[phrase_id] = count
-            else: # else perform template matching
-                try :
-                    fingerprinter = self.fingerprint.get_fingerprinter_from_string(phrase)
+            db.rollback()
 
-                    content_fingerprints = fingerprinter.generate(content)
-                    template_fingerprints = fingerprinter.generate(phrase)
+    def _set_phrases(self, phrase_dict):
+        """
+        Compiles a new phrase matcher for phrase_dict and swaps it in. Messages being matched concurrently keep using the
+        matcher they started with.
+        """
+        phrase_matcher = PhraseMatcher(phrase_dict, self.fingerprint)
 
-                    if len(content_fingerprints) == 0 or len(template_fingerprints) == 0:
-                        continue
+        self.phrase_dict = dict(phrase_dict)
+        self.phrase_matcher = phrase_matcher
 
-                    template_matches = template_match_fingerprints(template_fingerprints, content_fingerprints)
+    def _get_matched_phrase_ids(self, content):
+        with self.stage_seconds.time(("match",)):
+            return self.phrase_matcher.match(content)
 
-                    if len(template_matches) > 0:
-                        matched[phrase_id] = len(template_matches)
-                except:
-                    pass
+    def _ingest_message(self, db, message, content_ids=None, user_entries=None):
+        return self._ingest_messages(db, [message], content_ids, user_entries)
 
-        return matched
+    def _ingest_messages(self, db, messages, content_ids=None, user_entries=None):
+        """
+        Ingests a batch of messages with one multi-row statement per table. Messages that aren't ingestible are skipped,
+        and authors that aren't stored yet, i.e. members that left the guild, are stored along with their messages.
 
-    def _ingest_message(self, db, message):
-        if message.author == self.user:
-            return
+        :param content_ids: Optional dictionary filled with the digest:message_content_id of every content resolved in
+            the database, to be added to content_id_cache once the transaction is committed.
+        :param user_entries: Optional dictionary filled with the uid:(name, name_id) of the synced authors, to be added
+            to user_cache once the transaction is committed.
+        :return: The user_matched_phrases rows that were inserted.
+        """
+        with self.stage_seconds.time(("ingest",)):
+            return self._ingest_message_batch(db, messages, content_ids, user_entries)
+
+    def _ingest_message_batch(self, db, messages, content_ids, user_entries):
+        messages = [message for message in messages if message.author != self.user and self._is_ingestible(message)]
 
-        matched_count = self._get_matched_phrase_ids(message.content, db)
+        if len(messages) == 0:
+            return []
 
-        message_content_id = ingest_if_not_exist_returning(db, MESSAGE_CONTENT, {MESSAGE_CONTENT.CONTENT:message.content}, [MESSAGE_CONTENT.ID])
+        authors = self._ingest_users(db, list({message.author.id: message.author for message in messages}.values()))
+        if user_entries is not None:
+            user_entries.update(authors)
 
-        message_record = {
-            MESSAGES.UID: message.id,
-            MESSAGES.USER_ID: message.author.id,
-            MESSAGES.CHANNEL_ID: message.channel.id,
-            MESSAGES.MESSAGE_CONTENT_ID: message_content_id,
-            MESSAGES.CREATED_AT: message.created_at
-        }
+        with self.stage_seconds.time(("match_batch",)):
+            matched_counts = self.phrase_matcher.match_many([message.content for message in messages])
 
-        message_id = ingest_if_not_exist_returning(db, MESSAGES, message_record, [MESSAGES.UID])
+        digests = [content_digest(message.content) for message in messages]
+        message_content_ids = [self.content_id_cache.get(digest) for digest in digests]
 
-        if matched_count is not None and len(matched_count) > 0:
-            prepared_log = db.insertInto(USER_MATCHED_PHRASES, USER_MATCHED_PHRASES.PHRASE_ID, USER_MATCHED_PHRASES.USER_ID,
-                                         USER_MATCHED_PHRASES.GUILD_ID, USER_MATCHED_PHRASES.CHANNEL_ID, USER_MATCHED_PHRASES.MESSAGE_ID,
-                                         USER_MATCHED_PHRASES.MATCHES)
+        missing = [i for i, message_content_id in enumerate(message_content_ids) if message_content_id is None]
+        if len(missing) > 0:
+            resolved_ids = upsert_many_returning(db, MESSAGE_CONTENT, [{MESSAGE_CONTENT.DIGEST:digests[i], MESSAGE_CONTENT.CONTENT:messages[i].content}
+                                                                       for i in missing],
+                                                 [MESSAGE_CONTENT.ID], [MESSAGE_CONTENT.DIGEST])
+
+            for i, message_content_id in zip(missing, resolved_ids):
+                message_content_ids[i] = message_content_id
+
+                if content_ids is not None:
+                    content_ids[digests[i]] = message_content_id
+
+        message_records = []
+        matched_records = []
+
+        for message, message_content_id, matched_count in zip(messages, message_content_ids, matched_counts):
+            message_records.append({
+                MESSAGES.UID: message.id,
+                MESSAGES.USER_ID: message.author.id,
+                MESSAGES.CHANNEL_ID: message.channel.id,
+                MESSAGES.MESSAGE_CONTENT_ID: message_content_id,
+                MESSAGES.CREATED_AT: message.created_at
+            })
 
             for phrase_id in matched_count.keys():
                 if matched_count[phrase_id] > 0: # only ingest row if it has matches
-                    prepared_log = prepared_log.prepare(phrase_id, message.author.id, message.guild.id, message.channel.id, message_id, matched_count[phrase_id])
+                    matched_records.append({
+                        USER_MATCHED_PHRASES.PHRASE_ID: phrase_id,
+                        USER_MATCHED_PHRASES.USER_ID: message.author.id,
+                        USER_MATCHED_PHRASES.GUILD_ID: message.guild.id,
+                        USER_MATCHED_PHRASES.CHANNEL_ID: message.channel.id,
+                        USER_MATCHED_PHRASES.MESSAGE_ID: message.id,
+                        USER_MATCHED_PHRASES.MATCHES: matched_count[phrase_id]
+                    })
+
+        insert_if_not_exist(db, MESSAGES, message_records, [MESSAGES.UID])
+
+        # re-ingesting a message never double counts its matches, only rows that were actually inserted are rolled up
+        inserted_rows = insert_if_not_exist(db, USER_MATCHED_PHRASES, matched_records,
+                                            [USER_MATCHED_PHRASES.MESSAGE_ID, USER_MATCHED_PHRASES.PHRASE_ID],
+                                            [USER_MATCHED_PHRASES.PHRASE_ID, USER_MATCHED_PHRASES.USER_ID, USER_MATCHED_PHRASES.GUILD_ID,
+                                             USER_MATCHED_PHRASES.CHANNEL_ID, USER_MATCHED_PHRASES.MATCHES])
+
+        increment_rollups(db, inserted_rows)
+
+        self.messages_processed.inc(len(messages))
+        if self.metrics.enabled:
+            self.phrase_matches.inc(sum(row[USER_MATCHED_PHRASES.MATCHES] for row in inserted_rows))
+
+        return inserted_rows
 
-            prepared_log.execute()
+    async def _flush_messages(self, messages):
+        content_ids = {}
+        user_entries = {}
+
+        async with self.phrase_lock.shared(), self.db_pool.acquire() as db:
+            matched_rows = await db.run(self._ingest_messages, messages, content_ids, user_entries)
+
+            with self.stage_seconds.time(("commit",)):
+                await db.commit()
+
+        # only committed ids are cached, the id of a rolled back insert points at no row
+        self.content_id_cache.update(content_ids)
+        self.user_cache.update(user_entries)
+        self._invalidate_stats(matched_rows)
 
     def _get_help(self):
         message = ""
@@ -120,208 +314,502 @@ class GamerBot(discord.AutoShardedClient):
     def _get_phrase(self, db, phrase_id):
         return self.phrase_dict[phrase_id] #db.select(PHRASES.PHRASE).FROM(PHRASES).WHERE(Eq(PHRASES.ID, phrase_id)).LIMIT(1).fetchone
 
-    def _get_stats(self, db, conditional, location_str, no_match_string):
-        top_user_row = db.select(USER_MATCHED_PHRASES.USER_ID, Sum(USER_MATCHED_PHRASES.MATCHES)).FROM(
-            USER_MATCHED_PHRASES) \
-            .WHERE(conditional) \
-            .groupBy(USER_MATCHED_PHRASES.USER_ID).orderBy(("sum", Desc)).LIMIT(3).fetchmany(3)
+    def _get_leaderboard(self, db, table, conditional, user_limit=None, phrase_limit=3):
+        """
+        Ranks users by their total matches, together with each user's top phrases, in a single query.
 
-        if top_user_row is None:
-            return no_match_string
+        :param table: Table holding user_id, phrase_id and matches columns to rank, usually one of the rollups.
+        :param conditional: Conditional on table restricting the counted matches.
+        :param user_limit: Number of top users to return, None to return every matching user.
+        :param phrase_limit: Number of top phrases returned per user.
+        :return: Array of (user_id, total, [(phrase_id, count), ...]) ordered by total descending.
+        """
+        phrase_sum = Sum(table.MATCHES)
 
-        top_user = self.get_user(top_user_row[0][USER_MATCHED_PHRASES.USER_ID])
+        user_phrases = db.select(table.USER_ID, table.PHRASE_ID, phrase_sum,
+                                 SumOver(phrase_sum).OVER(partition_by=[table.USER_ID]).AS("total"),
+                                 RowNumber().OVER(partition_by=[table.USER_ID], order_by=[(phrase_sum, Desc)]).AS("phrase_rank")) \
+            .FROM(table).WHERE(conditional) \
+            .groupBy(table.USER_ID, table.PHRASE_ID).AS("user_phrases")
 
-        message = "The top GAMER of this {} is {} with a total count of: **{}**\n\n".format(location_str, top_user.mention,
-                                                                                            top_user_row[0]['sum'])
+        ranked = db.select(table.USER_ID, table.PHRASE_ID, "sum", "total", "phrase_rank",
+                           DenseRank().OVER(order_by=[("total", Desc), (table.USER_ID, Asc)]).AS("user_rank")) \
+            .FROM(user_phrases).WHERE(Lte("phrase_rank", phrase_limit)).AS("ranked")
 
-        for stat in top_user_row:
-            message += "{}: **{}**".format(self.get_user(stat[USER_MATCHED_PHRASES.USER_ID]).mention, stat['sum'])
-            message += self._get_user_stats(db, stat[USER_MATCHED_PHRASES.USER_ID], conditional)
-            message += "\n\n"
+        query = db.select(table.USER_ID, table.PHRASE_ID, "sum", "total").FROM(ranked)
 
-        return message
+        if user_limit is not None:
+            query = query.WHERE(Lte("user_rank", user_limit))
 
-    def _get_guild_stats(self, db, guild_id):
-        return self._get_stats(db, Eq(USER_MATCHED_PHRASES.GUILD_ID, guild_id), "sever", "Couldn't find any GAMERS in this guild.")
+        rows = query.orderBy(("user_rank", Asc), ("phrase_rank", Asc)).fetchall()
 
-    def _get_channel_stats(self, db, channel_id):
-        return self._get_stats(db, Eq(USER_MATCHED_PHRASES.CHANNEL_ID, channel_id), "channel", "Couldn't find any GAMERS in this channel.")
+        leaderboard = []
+        for row in rows:
+            if len(leaderboard) == 0 or leaderboard[-1][0] != row[table.USER_ID]:
+                leaderboard.append((row[table.USER_ID], row['total'], []))
 
-    def _get_user_stats(self, db, user_id, conditional):
-        message = ""
+            leaderboard[-1][2].append((row[table.PHRASE_ID], row['sum']))
+
+        return leaderboard
 
-        breakdown_ret = db.select(USER_MATCHED_PHRASES.USER_ID, USER_MATCHED_PHRASES.PHRASE_ID,
-                                  Sum(USER_MATCHED_PHRASES.MATCHES)) \
-            .FROM(USER_MATCHED_PHRASES).WHERE(conditional) \
-            .AND(Eq(USER_MATCHED_PHRASES.USER_ID, user_id)) \
-            .groupBy(USER_MATCHED_PHRASES.USER_ID, USER_MATCHED_PHRASES.PHRASE_ID) \
-            .orderBy(("sum", Desc)).LIMIT(3).fetchmany(3)
+    def _format_breakdown(self, db, breakdown):
+        message = ""
 
-        for i, stat in enumerate(breakdown_ret):
-            phrase = self._get_phrase(db, stat[USER_MATCHED_PHRASES.PHRASE_ID])
-            count = stat['sum']
+        for i, (phrase_id, count) in enumerate(breakdown):
+            phrase = self._get_phrase(db, phrase_id)
             message += "\n{}. `{}`: {}".format(i + 1, phrase, count)
 
         return message
 
+    def _get_stats(self, db, table, conditional, location_str, no_match_string):
+        leaderboard = self._get_leaderboard(db, table, conditional, user_limit=3)
+
+        if len(leaderboard) == 0:
+            return no_match_string
+
+        top_user = self.get_user(leaderboard[0][0])
+
+        message = "The top GAMER of this {} is {} with a total count of: **{}**\n\n".format(location_str, top_user.mention,
+                                                                                            leaderboard[0][1])
+
+        for user_id, total, breakdown in leaderboard:
+            message += "{}: **{}**".format(self.get_user(user_id).mention, total)
+            message += self._format_breakdown(db, breakdown)
+            message += "\n\n"
+
+        return message
+
+    def _get_guild_stats(self, db, guild_id):
+        return self._get_stats(db, GUILD_PHRASE_COUNTS, Eq(GUILD_PHRASE_COUNTS.GUILD_ID, guild_id), "sever", "Couldn't find any GAMERS in this guild.")
+
+    def _get_channel_stats(self, db, channel_id):
+        return self._get_stats(db, CHANNEL_PHRASE_COUNTS, Eq(CHANNEL_PHRASE_COUNTS.CHANNEL_ID, channel_id), "channel", "Couldn't find any GAMERS in this channel.")
+
     def _get_users_stats(self, db, user_ids):
         message = ""
 
         if len(user_ids) == 0:
             return self._get_help()
 
+        leaderboard = {user_id: (total, breakdown) for user_id, total, breakdown
+                       in self._get_leaderboard(db, GUILD_PHRASE_COUNTS, In(GUILD_PHRASE_COUNTS.USER_ID, user_ids))}
+
         for user_id in user_ids:
             user = self.get_user(user_id)
 
-            total_row = db.select(USER_MATCHED_PHRASES.USER_ID, Sum(USER_MATCHED_PHRASES.MATCHES)).FROM(
-                USER_MATCHED_PHRASES) \
-                .WHERE(Eq(USER_MATCHED_PHRASES.USER_ID, user_id)) \
-                .groupBy(USER_MATCHED_PHRASES.USER_ID).orderBy(("sum", Desc)).LIMIT(1).fetchone()
-
-            if total_row is None:
+            if user_id not in leaderboard:
                 message += "{} hasn't said any GAMER words.\n\n".format(user.mention)
             else:
-                message += "{}: **{}**".format(user.mention, total_row['sum'])
-                message += self._get_user_stats(db, user_id, Eq(USER_MATCHED_PHRASES.USER_ID, user_id))
+                total, breakdown = leaderboard[user_id]
+
+                message += "{}: **{}**".format(user.mention, total)
+                message += self._format_breakdown(db, breakdown)
 
                 message += "\n\n"
 
         return message
 
 
-    async def _handle_commands(self, db, message):
+    async def _query_stats(self, stats_func, *args):
+        async with self.db_pool.acquire() as db:
+            return await db.run(stats_func, *args)
+
+    async def _get_cached_stats(self, command, scope, scope_id, tags, stats_func, *args):
+        return await self.stats_cache.get_or_compute((scope, scope_id, command), tags,
+                                                     lambda: self._query_stats(stats_func, *args))
+
+    async def _recount_guild(self, guild, channel):
+        """
+        Recounts every stored message of the guild, editing a progress message in channel while it runs.
+
+        :return: Message to print once the recount is done.
+        """
+        if self.recount_engine.is_running(guild.id):
+            return "A recount is already running for this guild."
+
+        report = await self._send_progress(channel, "Recounting the messages of this guild...")
+
+        recounted = await self.recount_engine.recount(guild.id, self.phrase_dict, self.phrase_matcher.match_percent, report)
+
+        # recounted matches can change any stats of the guild, its channels and users
+        self.stats_cache.clear()
+
+        return "Recount finished, {} distinct messages recounted.".format(recounted)
+
+    async def _add_phrase(self, phrase, channel):
+        """
+        Starts tracking phrase, and counts it in the stored messages without recounting the other phrases.
+
+        :return: Message to print once the phrase is counted.
+        """
+        phrase = phrase.strip().lower()
+
+        if len(phrase) == 0:
+            return "Enter a phrase to add after `{}add`.".format(self.command_trigger)
+
+        async with self.db_pool.acquire() as db:
+            phrase_id = await db.run(upsert_returning, PHRASES, {PHRASES.PHRASE:phrase}, [PHRASES.ID])
+            await db.run(restore_phrase, phrase)
+            await db.commit()
+
+        if phrase_id in self.phrase_dict:
+            return "`{}` is already being tracked.".format(phrase)
+
+        # new messages are matched against the phrase from now on, the count below only adds messages missing a row
+        phrase_dict = dict(self.phrase_dict)
+        phrase_dict[phrase_id] = phrase
+        self._set_phrases(phrase_dict)
+
+        report = await self._send_progress(channel, "Counting `{}` in the stored messages...".format(phrase))
+
+        await self.recount_engine.count_phrase(phrase_id, phrase, self.phrase_matcher.match_percent, report)
+
+        self.stats_cache.clear()
+
+        return "Now tracking `{}` with id {}.".format(phrase, phrase_id)
+
+    async def _remove_phrase(self, phrase_id):
+        """
+        Stops tracking a phrase, dropping its matches and rollups. The other phrases' counts are left untouched.
+
+        :return: Message to print once the phrase is removed.
+        """
+        try:
+            phrase_id = int(phrase_id)
+        except ValueError:
+            return "Enter the id of the phrase to remove, ids can be found using `{}list`.".format(self.command_trigger)
+
+        if phrase_id not in self.phrase_dict:
+            return "Couldn't find a phrase with id {}.".format(phrase_id)
+
+        phrase = self.phrase_dict[phrase_id]
+
+        phrase_dict = dict(self.phrase_dict)
+        del phrase_dict[phrase_id]
+        self._set_phrases(phrase_dict)
+
+        # batches matched against the phrase before the swap are written before it is deleted, and the ones waiting on
+        # the lock match against the swapped matcher. Recounts still running drop its staged matches once it is gone.
+        async with self.phrase_lock.exclusive(), self.db_pool.acquire() as db:
+            await db.run(delete_phrase, phrase_id)
+            await db.commit()
+
+        self.stats_cache.clear()
+
+        return "Stopped tracking `{}`.".format(phrase)
+
+    def _get_phrase_list(self):
+        message = ""
+
+        for phrase_id, phrase in sorted(self.phrase_dict.items()):
+            message += "{}: `{}`\n".format(phrase_id, phrase)
+
+        return message if len(message) > 0 else "No phrases are being tracked."
+
+    @staticmethod
+    async def _send_progress(channel, text):
+        """
+        Sends text to channel, and returns a report(done, total) coroutine function editing the progress into it.
+        """
+        status = await channel.send(text)
+
+        async def report(done, total):
+            await status.edit(content="{} {}/{} ({:.0%})".format(text, done, total, done / total if total > 0 else 1))
+
+        return report
+
+    @staticmethod
+    def _get_command_argument(message):
+        parts = message.content.split(' ', 1)
+
+        return parts[1] if len(parts) > 1 else ""
+
+    @staticmethod
+    def _is_superuser(message):
+        permissions = getattr(message.author, 'guild_permissions', None)
+
+        return permissions is not None and permissions.administrator
+
+    async def _handle_commands(self, message):
         command = message.content.split('!')[1].split(' ')[0]
 
-        if command == "":
-            print_message = self._get_guild_stats(db, message.guild.id)
+        # unknown commands share a label, the label values stay bounded whatever users type
+        with self.command_seconds.time((command if command in self.commands else "help",)):
+            await self._answer_command(message, command)
+
+    async def _answer_command(self, message, command):
+        if command in self.commands and self.commands[command]['super'] and not self._is_superuser(message):
+            print_message = "`{}{}` is for superusers only.".format(self.command_trigger, command)
+        elif command == "recount":
+            print_message = await self._recount_guild(message.guild, message.channel)
+        elif command == "add":
+            print_message = await self._add_phrase(self._get_command_argument(message), message.channel)
+        elif command == "remove":
+            print_message = await self._remove_phrase(self._get_command_argument(message))
+        elif command == "list":
+            print_message = self._get_phrase_list()
+        elif command == "":
+            print_message = await self._get_cached_stats(command, "guild", message.guild.id, [("guild", message.guild.id)],
+                                                         self._get_guild_stats, message.guild.id)
         elif command == "user":
-            print_message = self._get_users_stats(db, message.raw_mentions)
+            user_ids = message.raw_mentions
+            print_message = await self._get_cached_stats(command, "user", tuple(user_ids), [("user", user_id) for user_id in user_ids],
+                                                         self._get_users_stats, user_ids)
         elif command == "channel":
-            print_message = self._get_channel_stats(db, message.channel.id)
+            print_message = await self._get_cached_stats(command, "channel", message.channel.id, [("channel", message.channel.id)],
+                                                         self._get_channel_stats, message.channel.id)
         else:
             print_message = self._get_help()
 
         await message.channel.send(print_message)
 
+    def _invalidate_stats(self, matched_rows):
+        """
+        Drops the cached stats of every guild, channel and user that received new matches.
+        """
+        tags = set()
+
+        for row in matched_rows:
+            tags.add(("guild", row[USER_MATCHED_PHRASES.GUILD_ID]))
+            tags.add(("channel", row[USER_MATCHED_PHRASES.CHANNEL_ID]))
+            tags.add(("user", row[USER_MATCHED_PHRASES.USER_ID]))
+
+        self.stats_cache.invalidate(tags)
+
     @staticmethod
     def _ingest_name_lookup_table(db, table, uid_column, uid_value, name_id_column, name_id_value):
-        uid_row = fetchone_from_table(db, table, {uid_column:uid_value}, table.columns)
-        ret_id = uid_value
+        # insert new uids, and only rewrite existing rows when the name actually changed
+        db.insertInto(table, uid_column, name_id_column).prepare(uid_value, name_id_value)\
+            .onConflict(uid_column).doUpdate(name_id_column, changed_only=True).execute()
 
-        if uid_row is not None and uid_row[name_id_column] != name_id_value:
-            db.update(table).set(name_id_column, name_id_value).WHERE(Eq(uid_column, uid_value)).execute()
-        elif uid_row is None:
-            ret_id = ingest_if_not_exist_returning(db, table, {uid_column:uid_value, name_id_column:name_id_value}, [uid_column])
-
-        return ret_id
+        return uid_value
 
     @staticmethod
-    def _ingest_user(db, user):
-        user_name_id = ingest_if_not_exist_returning(db, USER_NAMES, {USER_NAMES.USER_NAME:user.name}, [USER_NAMES.ID])
+    def _is_cached_name(cache, uid, name):
+        entry = cache.get(uid)
 
-        user_id = GamerBot._ingest_name_lookup_table(db, USERS, USERS.UID, user.id, USERS.USER_NAME_ID, user_name_id)
+        return entry is not None and entry[0] == name
 
-        return user_id
+    # The lookup ingestion methods skip every uid whose cached name still matches, and return the uid:(name, name_id)
+    # entries they synced. Callers add those to the cache once committed, so the cache never holds rolled back rows.
 
-    @staticmethod
-    def _ingest_guild(db, guild):
-        guild_name_id = ingest_if_not_exist_returning(db, GUILD_NAMES, {GUILD_NAMES.GUILD_NAME:guild.name}, [GUILD_NAMES.ID])
+    def _ingest_user(self, db, user):
+        return self._ingest_users(db, [user])
 
-        guild_id = GamerBot._ingest_name_lookup_table(db, GUILDS, GUILDS.UID, guild.id, GUILDS.GUILD_NAME_ID, guild_name_id)
+    def _ingest_users(self, db, users):
+        users = [user for user in users if not self._is_cached_name(self.user_cache, user.id, user.name)]
 
-        return guild_id
+        rows = [{USERS.UID: user.id, USER_NAMES.USER_NAME: user.name} for user in users]
 
-    @staticmethod
-    def _ingest_channel(db, channel):
-        if isinstance(channel, discord.TextChannel): # only care about text channels
-            channel_name_id = ingest_if_not_exist_returning(db, CHANNEL_NAMES, {CHANNEL_NAMES.CHANNEL_NAME:channel.name}, [CHANNEL_NAMES.ID])
+        name_ids = sync_name_lookup_table(db, USERS, USERS.UID, USERS.USER_NAME_ID, USER_NAMES, USER_NAMES.USER_NAME, rows)
 
-            channel_id = GamerBot._ingest_name_lookup_table(db, CHANNELS, CHANNELS.UID, channel.id, CHANNELS.CHANNEL_NAME_ID,  channel_name_id)
+        return {user.id: (user.name, name_ids[user.id]) for user in users}
 
-            return channel_id
-        else:
-            return None
+    def _ingest_guild(self, db, guild):
+        if self._is_cached_name(self.guild_cache, guild.id, guild.name):
+            return {}
+
+        guild_name_id = upsert_returning(db, GUILD_NAMES, {GUILD_NAMES.GUILD_NAME:guild.name}, [GUILD_NAMES.ID])
+
+        self._ingest_name_lookup_table(db, GUILDS, GUILDS.UID, guild.id, GUILDS.GUILD_NAME_ID, guild_name_id)
+
+        return {guild.id: (guild.name, guild_name_id)}
+
+    def _ingest_channel(self, db, channel):
+        return self._ingest_channels(db, [channel])
+
+    def _ingest_channels(self, db, channels):
+        channels = [channel for channel in channels if isinstance(channel, discord.TextChannel) # only care about text channels
+                    and not self._is_cached_name(self.channel_cache, channel.id, channel.name)]
+
+        rows = [{CHANNELS.UID: channel.id, CHANNEL_NAMES.CHANNEL_NAME: channel.name, CHANNELS.GUILD_ID: channel.guild.id}
+                for channel in channels]
+
+        name_ids = sync_name_lookup_table(db, CHANNELS, CHANNELS.UID, CHANNELS.CHANNEL_NAME_ID, CHANNEL_NAMES, CHANNEL_NAMES.CHANNEL_NAME, rows)
+
+        return {channel.id: (channel.name, name_ids[channel.id]) for channel in channels}
+
+    async def _run_lookup_ingest(self, cache, ingest, *args):
+        async with self.db_pool.acquire() as db:
+            entries = await db.run(ingest, *args)
+
+            await db.commit()
+
+        cache.update(entries)
+
+    @staticmethod
+    def _is_ingestible(message):
+        # direct messages have no guild or stored channel, and webhooks post as authors that aren't users
+        return message.guild is not None and isinstance(message.channel, discord.TextChannel) and message.webhook_id is None
 
     @staticmethod
     def _is_command_message(message):
         return message.content.startswith(GamerBot.command_trigger) or message.content.startswith(GamerBot.help_trigger)
 
-    async def _ingest_channel_history(self, db, channel):
+    def _get_backfill_checkpoint(self, db, channel_id):
+        checkpoint = db.select(CHANNEL_BACKFILL.LAST_MESSAGE_UID).FROM(CHANNEL_BACKFILL)\
+            .WHERE(Eq(CHANNEL_BACKFILL.CHANNEL_ID, channel_id)).fetchone()
+
+        # checkpoints are seeded with the guild snapshot, channels created since resume from their newest message
+        # stored before the bot started, later ones may be live messages sent ahead of the channel's history
+        if checkpoint is None:
+            checkpoint = db.select(MESSAGES.UID).FROM(MESSAGES).WHERE(Eq(MESSAGES.CHANNEL_ID, channel_id))\
+                .AND(Lt(MESSAGES.UID, self.started_uid)).orderBy((MESSAGES.UID, Desc)).LIMIT(1).fetchone()
+
+        return checkpoint
+
+    def _ingest_history_chunk(self, db, channel_id, messages, content_ids=None, user_entries=None):
+        matched_rows = self._ingest_messages(db, [message for message in messages if not self._is_command_message(message)],
+                                             content_ids, user_entries)
+
+        # snowflakes are time ordered, so the largest id is the newest message of the chunk
+        db.insertInto(CHANNEL_BACKFILL, CHANNEL_BACKFILL.CHANNEL_ID, CHANNEL_BACKFILL.LAST_MESSAGE_UID)\
+            .prepare(channel_id, max(message.id for message in messages))\
+            .onConflict(CHANNEL_BACKFILL.CHANNEL_ID).doUpdate(CHANNEL_BACKFILL.LAST_MESSAGE_UID).execute()
+
+        return matched_rows
+
+    async def _flush_history_chunk(self, channel_id, messages):
+        content_ids = {}
+        user_entries = {}
+
+        async with self.phrase_lock.shared(), self.db_pool.acquire() as db:
+            matched_rows = await db.run(self._ingest_history_chunk, channel_id, messages, content_ids, user_entries)
+
+            with self.stage_seconds.time(("commit",)):
+                await db.commit()
+
+        self.content_id_cache.update(content_ids)
+        self.user_cache.update(user_entries)
+        self._invalidate_stats(matched_rows)
+
+    async def _ingest_channel_history(self, channel, rate_limiter=None, progress=None):
+        """
+        Streams a channel's history from its backfill checkpoint, committing every chunk together with the checkpoint so
+        an interrupted backfill resumes where it stopped.
+
+        :param rate_limiter: Optional RateLimiter acquired before every history request.
+        :param progress: Optional BackfillProgress updated after every committed chunk.
+        """
         if not isinstance(channel, discord.TextChannel):
             return
 
-        last_message_time = db.select(MESSAGES.CREATED_AT).FROM(MESSAGES).WHERE(Eq(MESSAGES.CHANNEL_ID, channel.id))\
-            .orderBy((MESSAGES.CREATED_AT, Desc)).LIMIT(1).fetchone()
+        with self.stage_seconds.time(("history",)):
+            async with self.db_pool.acquire() as db:
+                checkpoint = await db.run(self._get_backfill_checkpoint, channel.id)
 
-        for message in await channel.history(limit=None, after=last_message_time, oldest_first=True).flatten(): # iterate over all channel history from last message
-            if not self._is_command_message(message):
-                self._ingest_message(db, message)
+            after = discord.Object(id=checkpoint) if checkpoint is not None else None
 
-    async def on_ready(self):
-        db = Database(self.db_connection)
+            history = channel.history(limit=None, after=after, oldest_first=True)
 
-        for guild in self.guilds:
-            await self.on_guild_join(guild)
+            chunk = []
+            fetched = 0
+            while True:
+                # the history iterator requests a new page whenever the previous one is used up
+                if rate_limiter is not None and fetched % self.history_page_size == 0:
+                    await rate_limiter.acquire(channel.id)
+
+                try:
+                    message = await history.next()
+                except discord.NoMoreItems:
+                    break
+
+                fetched += 1
+                chunk.append(message)
 
-        # for channel in self.get_all_channels():
-        #     await self._ingest_channel_history(db, channel)
+                if len(chunk) >= self.backfill_chunk_size:
+                    await self._flush_history_chunk(channel.id, chunk)
+                    if progress is not None:
+                        progress.record_messages(len(chunk))
+                    chunk = []
 
-        db.commit()
+            if len(chunk) > 0:
+                await self._flush_history_chunk(channel.id, chunk)
+                if progress is not None:
+                    progress.record_messages(len(chunk))
+
+    async def on_ready(self):
+        for guild in self.guilds:
+            await self._ingest_guild_snapshot(guild)
+
+        # backfill every guild's channels together so the most recently active channels across guilds go first
+        await self.backfill_scheduler.run([channel for guild in self.guilds for channel in guild.text_channels])
 
     async def on_message(self, message):
         if message.author == self.user:
             return
 
-        db = Database(self.db_connection)
+        if not self._is_ingestible(message):
+            return
 
         if self._is_command_message(message):
-            await self._handle_commands(db, message)
+            await self._handle_commands(message)
         else:
-            self._ingest_message(db, message)
-
-        db.commit()
+            await self.ingest_queue.put(message)
 
     async def on_guild_channel_update(self, before, after):
         if before.name != after.name:
-            db = Database(self.db_connection)
-
-            new_name_id = ingest_if_not_exist_returning(db, CHANNEL_NAMES, {CHANNEL_NAMES.CHANNEL_NAME:after.name}, [CHANNEL_NAMES.ID])
-            db.update(CHANNELS).set(CHANNELS.CHANNEL_NAME_ID, new_name_id).WHERE(Eq(CHANNELS.UID, before.id)).execute()
+            await self._run_lookup_ingest(self.channel_cache, self._ingest_channel, after)
 
     async def on_guild_channel_create(self, channel):
-        db = Database(self.db_connection)
-        self._ingest_channel(db, channel)
-
-        db.commit()
+        await self._run_lookup_ingest(self.channel_cache, self._ingest_channel, channel)
 
     async def on_member_join(self, member):
-        db = Database(self.db_connection)
-        self._ingest_user(db, member)
+        await self._run_lookup_ingest(self.user_cache, self._ingest_user, member)
 
-        db.commit()
+    async def on_member_update(self, before, after):
+        if before.name != after.name:
+            await self._run_lookup_ingest(self.user_cache, self._ingest_user, after)
 
-    async def on_guild_update(self, before, after):
+    async def on_user_update(self, before, after):
         if before.name != after.name:
-            db = Database(self.db_connection)
+            await self._run_lookup_ingest(self.user_cache, self._ingest_user, after)
 
-            new_name_id = ingest_if_not_exist_returning(db, GUILD_NAMES, {GUILD_NAMES.GUILD_NAME:after.name}, [GUILD_NAMES.ID])
-            db.update(GUILDS).set(GUILDS.GUILD_NAME_ID, new_name_id).WHERE(Eq(GUILDS.UID, before.id)).execute()
+    async def on_guild_update(self, before, after):
+        if before.name != after.name:
+            await self._run_lookup_ingest(self.guild_cache, self._ingest_guild, after)
 
     async def on_guild_join(self, guild):
-        db = Database(self.db_connection)
-        self._ingest_guild(db, guild)
+        await self._ingest_guild_snapshot(guild)
 
-        for user in guild.members:
-            self._ingest_user(db, user)
+        # split history ingestion from normal channel ingestion for efficiency. Want channels in first to allow processing
+        # of messages as they come in
+        await self.backfill_scheduler.run(guild.text_channels)
 
-        for channel in guild.text_channels:
-            self._ingest_channel(db, channel)
+    async def _ingest_guild_snapshot(self, guild):
+        async with self.db_pool.acquire() as db:
+            guild_entries = await db.run(self._ingest_guild, guild)
+            user_entries = await db.run(self._ingest_users, guild.members)
+            channel_entries = await db.run(self._ingest_channels, guild.text_channels)
+            await db.run(seed_backfill_checkpoints, [channel.id for channel in guild.text_channels], self.started_uid)
 
-        db.commit()
+            await db.commit()
 
-        # split history ingestion from normal channel ingestion for efficiency. Want channels in first to allow processing
-        # of messages as they come in
-        for channel in guild.text_channels:
-            await self._ingest_channel_history(db, channel)
+        self.guild_cache.update(guild_entries)
+        self.user_cache.update(user_entries)
+        self.channel_cache.update(channel_entries)
+
+    async def start(self, *args, **kwargs):
+        self.ingest_queue.start()
+        self._partition_task = asyncio.get_event_loop().create_task(self._maintain_partitions())
+
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        if self.is_closed():
+            return
+
+        await super().close()
+        await self.ingest_queue.close()
+        self.recount_engine.close()
+
+        if self._partition_task is not None:
+            self._partition_task.cancel()
+
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
 
-        db.commit()
+        self.db_pool.close()
@@ -0,0 +1,227 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import asyncio
+import collections
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from .database.recount import apply_staged_matches, count_phrase_candidates, create_recount_staging, \
+    phrase_candidate_pattern, select_guild_contents, select_phrase_candidates, stage_recount_matches, \
+    stage_recount_messages, swap_recount_matches
+from .util.matcher import PhraseMatcher
+from .util.shared_lock import SharedLock
+
+log = logging.getLogger(__name__)
+
+# matcher of the worker process, rebuilt whenever a chunk arrives for different phrases
+_worker_key = None
+_worker_matcher = None
+
+
+def _match_chunk(phrase_items, fingerprint_factory, match_percent, rows):
+    """
+    Runs in a worker process.
+
+    :param phrase_items: Sorted tuple of (phrase_id, phrase) to match.
+    :param fingerprint_factory: Picklable callable returning the fingerprint factory used by PhraseMatcher.
+    :param match_percent: Percent of acceptance for a template to match.
+    :param rows: Array of (message_content_id, content).
+    :return: Array of (message_content_id, phrase_id, matches) for every phrase with at least one match.
+    """
+    global _worker_key, _worker_matcher
+
+    key = (phrase_items, fingerprint_factory, match_percent)
+    if key != _worker_key:
+        _worker_matcher = PhraseMatcher(dict(phrase_items), fingerprint_factory(), match_percent)
+        _worker_key = key
+
+    matched_counts = _worker_matcher.match_many([content for _, content in rows])
+
+    matches = []
+    for (content_id, _), matched_count in zip(rows, matched_counts):
+        for phrase_id, count in matched_count.items():
+            if count > 0:
+                matches.append((content_id, phrase_id, count))
+
+    return matches
+
+
+class RecountEngine(object):
+    """
+    Recounts the phrase matches of every stored message of a guild, or counts a single new phrase across every stored
+    message.
+
+    Distinct message contents are streamed from a server side cursor in chunks and matched on a process pool, and the
+    matches are bulk copied into a staging table. The guild's user_matched_phrases rows and rollups are then replaced
+    from the staging table in the same transaction, so stats keep showing the old counts until the recount is done.
+
+    Counting a new phrase only streams the contents that can contain it, and adds its matches on top of the existing
+    rows and rollups instead of replacing them.
+
+    Staged matches are written holding phrase_lock shared, so a phrase can't be deleted while its matches are written.
+
+    i.e:
+    engine = RecountEngine(db_pool, Fingerprint, workers=4)
+    recounted = await engine.recount(guild.id, phrase_dict, report=report_progress)
+    counted = await engine.count_phrase(phrase_id, phrase)
+    """
+    def __init__(self, db_pool, fingerprint_factory, phrase_lock=None, workers=None, chunk_size=2000, progress_interval=10):
+        """
+        :param db_pool: DatabasePool to run the recount on.
+        :param fingerprint_factory: Picklable callable returning a fingerprint factory, i.e. the Fingerprint class.
+        :param phrase_lock: SharedLock held exclusively while phrases are deleted, a new one is created if not provided.
+        :param workers: Number of matching processes, one per CPU if not provided.
+        :param chunk_size: Number of message contents per chunk sent to a worker.
+        :param progress_interval: Minimum seconds between progress reports.
+        """
+        if chunk_size < 1:
+            raise ValueError("Chunk size needs to be at least 1.")
+
+        self.db_pool = db_pool
+        self.fingerprint_factory = fingerprint_factory
+        self.phrase_lock = phrase_lock if phrase_lock is not None else SharedLock()
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+
+        self._executor = None
+        self._running = set()
+
+    def is_running(self, guild_id):
+        return guild_id in self._running
+
+    async def count_phrase(self, phrase_id, phrase, match_percent=0.6, report=None):
+        """
+        Counts a newly tracked phrase in every stored message.
+
+        :param phrase_id: Id of the phrase.
+        :param phrase: The phrase to count.
+        :param match_percent: Percent of acceptance for a template to match.
+        :param report: Optional coroutine function called as report(done, total) with the number of scanned candidate
+            message contents, at most every progress_interval seconds.
+        :return: Number of scanned candidate message contents.
+        """
+        pattern = phrase_candidate_pattern(phrase)
+
+        async with self.db_pool.acquire() as db:
+            total = await db.run(count_phrase_candidates, pattern)
+
+            await db.run(create_recount_staging)
+
+            done = await self._stage_matches(db, select_phrase_candidates(db, pattern), ((phrase_id, phrase),),
+                                             match_percent, total, report)
+
+            async with self.phrase_lock.shared():
+                await db.run(apply_staged_matches)
+                await db.commit()
+
+        log.info("Counted phrase %s in %d candidate message contents.", phrase_id, done)
+
+        return done
+
+    async def recount(self, guild_id, phrase_dict, match_percent=0.6, report=None):
+        """
+        :param guild_id: Guild to recount.
+        :param phrase_dict: Dictionary of phrase_id:phrase to count.
+        :param match_percent: Percent of acceptance for a template to match.
+        :param report: Optional coroutine function called as report(done, total) with the number of recounted message
+            contents, at most every progress_interval seconds.
+        :return: Number of recounted message contents.
+        """
+        if guild_id in self._running:
+            raise ValueError("Guild ['{}'] is already being recounted.".format(guild_id))
+
+        self._running.add(guild_id)
+        try:
+            return await self._recount(guild_id, tuple(sorted(phrase_dict.items())), match_percent, report)
+        finally:
+            self._running.discard(guild_id)
+
+    async def _recount(self, guild_id, phrase_items, match_percent, report):
+        async with self.db_pool.acquire() as db:
+            total = await db.run(stage_recount_messages, guild_id)
+
+            if total == 0:
+                return 0
+
+            await db.run(create_recount_staging)
+
+            done = await self._stage_matches(db, select_guild_contents(db), phrase_items, match_percent, total, report)
+
+            async with self.phrase_lock.shared():
+                await db.run(swap_recount_matches, guild_id)
+                await db.commit()
+
+        log.info("Recounted %d message contents of guild %s.", done, guild_id)
+
+        return done
+
+    async def _stage_matches(self, db, query, phrase_items, match_percent, total, report):
+        """
+        Streams the (id, content) rows of query through the worker processes into the staging table.
+
+        :return: Number of streamed message contents.
+        """
+        loop = asyncio.get_event_loop()
+
+        if self._executor is None:
+            self._executor = self._create_executor()
+
+        # a few chunks per worker are kept in flight so workers never wait on the cursor, without buffering the table
+        pending = collections.deque()
+        max_pending = self.workers * 2
+        done = 0
+        last_report = loop.time()
+
+        batches = query.fetchiter(self.chunk_size)
+        try:
+            async for batch in batches:
+                rows = [tuple(row) for row in batch]
+                pending.append((len(rows), loop.run_in_executor(
+                    self._executor, functools.partial(_match_chunk, phrase_items, self.fingerprint_factory, match_percent, rows))))
+
+                while len(pending) >= max_pending:
+                    done += await self._stage(db, pending.popleft())
+
+                    if report is not None and loop.time() - last_report >= self.progress_interval:
+                        last_report = loop.time()
+                        await report(done, total)
+        finally:
+            await batches.aclose()
+
+        while len(pending) > 0:
+            done += await self._stage(db, pending.popleft())
+
+        if report is not None:
+            await report(done, total)
+
+        return done
+
+    def _create_executor(self):
+        # forked workers would inherit the bot's event loop, pooled connections and executor threads mid use, spawned
+        # workers start from a clean interpreter. Python 3.6 has no mp_context and can only fork.
+        if sys.version_info < (3, 7):
+            return ProcessPoolExecutor(max_workers=self.workers)
+
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @staticmethod
+    async def _stage(db, chunk):
+        count, matches = chunk
+        await db.run(stage_recount_matches, await matches)
+
+        return count
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
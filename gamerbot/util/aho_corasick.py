@@ -0,0 +1,127 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+from collections import deque
+
+
+class MultiPatternCounter(object):
+    """
+    Aho-Corasick automaton that counts many patterns in a single pass over a text.
+
+    Counts follow str.count semantics for every pattern independently: occurrences of the same pattern never overlap
+    and are taken left to right, while different patterns may overlap or be substrings of each other.
+
+    i.e:
+    counter = MultiPatternCounter({1: "gamer", 2: "gamers", 3: "aa"})
+    counter.count("gamers aaa gamer")
+    return = {1: 2, 2: 1, 3: 1}
+    """
+    def __init__(self, patterns=None):
+        """
+        :param patterns: Dictionary of key:pattern to count.
+        """
+        self.rebuild(patterns or {})
+
+    def rebuild(self, patterns):
+        """
+        Replaces the counted patterns, recompiling the automaton.
+
+        :param patterns: Dictionary of key:pattern to count.
+        """
+        keys = []
+        lengths = []
+        empty_keys = []
+
+        goto = [{}]
+        terminals = [[]]
+
+        for key, pattern in patterns.items():
+            if len(pattern) == 0:
+                empty_keys.append(key)
+                continue
+
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    terminals.append([])
+                state = next_state
+
+            terminals[state].append(len(keys))
+            keys.append(key)
+            lengths.append(len(pattern))
+
+        # Breadth first construction of the failure links, folding them into a complete transition table so counting
+        # never has to walk failure links. Transitions back to the root are left implicit.
+        fail = [0] * len(goto)
+        delta = [dict(transitions) for transitions in goto]
+        outputs = [tuple(terminal) for terminal in terminals]
+
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            fail_state = fail[state]
+
+            outputs[state] = outputs[state] + outputs[fail_state]
+
+            for char, next_state in delta[fail_state].items():
+                if char not in delta[state]:
+                    delta[state][char] = next_state
+
+            for char, next_state in goto[state].items():
+                fail[next_state] = delta[fail_state].get(char, 0)
+                queue.append(next_state)
+
+        self._keys = keys
+        self._lengths = lengths
+        self._empty_keys = empty_keys
+        self._delta = delta
+        self._outputs = outputs
+
+    def __len__(self):
+        return len(self._keys) + len(self._empty_keys)
+
+    def count(self, text):
+        """
+        Counts every pattern in text.
+
+        :param text: Text to search.
+        :return: Dictionary of key:count for every pattern with at least one occurrence.
+        """
+        counts = {}
+
+        for key in self._empty_keys:
+            counts[key] = len(text) + 1
+
+        if len(self._keys) == 0:
+            return counts
+
+        delta = self._delta
+        outputs = self._outputs
+        lengths = self._lengths
+
+        pattern_counts = [0] * len(self._keys)
+        next_start = [0] * len(self._keys)
+
+        state = 0
+        for i, char in enumerate(text):
+            state = delta[state].get(char, 0)
+
+            for pattern_idx in outputs[state]:
+                start = i - lengths[pattern_idx] + 1
+                if start >= next_start[pattern_idx]:  # skip occurrences overlapping the last counted one
+                    pattern_counts[pattern_idx] += 1
+                    next_start[pattern_idx] = i + 1
+
+        for pattern_idx, count in enumerate(pattern_counts):
+            if count > 0:
+                counts[self._keys[pattern_idx]] = count
+
+        return counts
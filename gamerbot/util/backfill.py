@@ -0,0 +1,189 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class _TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """
+        Seconds until a token is available, 0 if one is available now.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter(object):
+    """
+    Client side token buckets mirroring Discord's rate limits: one bucket per route, as the message history route is
+    bucketed per channel, and one global bucket shared by every route. Waiting here keeps the backfill from running into
+    429 responses that would also stall the live event handlers.
+    """
+    def __init__(self, route_rate=1.0, global_rate=40.0):
+        """
+        :param route_rate: Requests per second allowed for a single route.
+        :param global_rate: Requests per second allowed across all routes.
+        """
+        self.route_rate = route_rate
+        self._global = _TokenBucket(global_rate, max(1.0, global_rate))
+        self._routes = {}
+
+    async def acquire(self, route):
+        if route not in self._routes:
+            self._routes[route] = _TokenBucket(self.route_rate, max(1.0, self.route_rate))
+
+        bucket = self._routes[route]
+
+        while True:
+            now = time.monotonic()
+            delay = max(self._global.delay(now), bucket.delay(now))
+
+            if delay <= 0:
+                self._global.take()
+                bucket.take()
+                return
+
+            await asyncio.sleep(delay)
+
+    def release(self, route):
+        """
+        Drops the bucket of a route that won't be requested anymore.
+        """
+        self._routes.pop(route, None)
+
+
+class BackfillProgress(object):
+    def __init__(self):
+        self.started = time.monotonic()
+        self.channels_total = 0
+        self.channels_done = 0
+        self.messages = 0
+
+    def add_channels(self, count):
+        self.channels_total += count
+
+    def channel_done(self):
+        self.channels_done += 1
+
+    def record_messages(self, count):
+        self.messages += count
+
+    def messages_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.messages / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """
+        Estimated seconds left, extrapolated from the time taken per finished channel. None until a channel finished.
+        """
+        if self.channels_done == 0:
+            return None
+
+        elapsed = time.monotonic() - self.started
+        return elapsed / self.channels_done * (self.channels_total - self.channels_done)
+
+    def __str__(self):
+        eta = self.eta()
+
+        return "{}/{} channels, {} messages, {:.1f} messages/s, ETA {}".format(
+            self.channels_done, self.channels_total, self.messages, self.messages_per_second(),
+            "unknown" if eta is None else "{:.0f}s".format(eta))
+
+
+class BackfillScheduler(object):
+    """
+    Runs channel backfills concurrently, bounded by a concurrency limit shared by every run, with the most recently
+    active channels first. Every run tracks its own progress, and channels still being backfilled by an earlier run,
+    i.e. when on_ready fires again after a reconnect, are skipped.
+
+    i.e:
+    scheduler = BackfillScheduler(bot._ingest_channel_history, concurrency=4)
+    await scheduler.run(guild.text_channels)
+    """
+    def __init__(self, backfill, concurrency=4, rate_limiter=None, progress_interval=30):
+        """
+        :param backfill: Coroutine function called as backfill(channel, rate_limiter, progress).
+        :param concurrency: Maximum number of channels backfilled at the same time.
+        :param rate_limiter: RateLimiter shared by every backfill, one with default rates is created if not provided.
+        :param progress_interval: Seconds between progress logs while a backfill is running.
+        """
+        if concurrency < 1:
+            raise ValueError("Concurrency needs to be at least 1.")
+
+        self.backfill = backfill
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.progress_interval = progress_interval
+
+        self._semaphore = None
+        self._runs = [] # progress of every active run
+        self._in_flight = set() # ids of the channels scheduled by an active run
+        self._reporter = None
+
+    async def run(self, channels):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        # snowflakes are time ordered, a larger last message id means a more recently active channel
+        channels = sorted([channel for channel in channels if channel.id not in self._in_flight],
+                          key=lambda c: getattr(c, 'last_message_id', None) or 0, reverse=True)
+
+        if len(channels) == 0:
+            return
+
+        progress = BackfillProgress()
+        progress.add_channels(len(channels))
+
+        self._in_flight.update(channel.id for channel in channels)
+        self._runs.append(progress)
+        if self._reporter is None:
+            self._reporter = asyncio.get_event_loop().create_task(self._report())
+
+        try:
+            # semaphore waiters are woken in order, so channels start in priority order
+            await asyncio.gather(*[self._run_channel(channel, progress) for channel in channels])
+        finally:
+            self._runs.remove(progress)
+            if len(self._runs) == 0:
+                self._reporter.cancel()
+                self._reporter = None
+
+            log.info("Backfill finished: %s", progress)
+
+    async def _run_channel(self, channel, progress):
+        try:
+            async with self._semaphore:
+                try:
+                    await self.backfill(channel, self.rate_limiter, progress)
+                except Exception:
+                    log.exception("Backfill of channel %s failed.", channel.id)
+        finally:
+            self._in_flight.discard(channel.id)
+            self.rate_limiter.release(channel.id)
+            progress.channel_done()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+
+            for progress in self._runs:
+                log.info("Backfill progress: %s", progress)
@@ -0,0 +1,141 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BatchQueue(object):
+    """
+    Bounded in-memory write-behind queue. Items are handed to flush_callback in batches, whenever flush_size items are
+    queued or flush_interval seconds have passed since the first item of the batch, whichever comes first.
+
+    A failing batch is retried with an exponential backoff, for transient errors. If it keeps failing it is split in
+    halves that are flushed on their own, until the items that can't be flushed are isolated and dropped.
+
+    i.e:
+    queue = BatchQueue(ingest_batch, flush_size=100, flush_interval=0.5)
+    queue.start()
+    await queue.put(message)
+    await queue.close()  # flushes anything still queued
+    """
+    def __init__(self, flush_callback, flush_size=100, flush_interval=0.5, max_depth=10000, retries=2, retry_delay=0.5):
+        """
+        :param flush_callback: Coroutine function called with each batch, as a list, in queue order.
+        :param flush_size: Maximum number of items per batch.
+        :param flush_interval: Maximum number of seconds an item waits before its batch is flushed.
+        :param max_depth: Maximum number of queued items, put waits while the queue is full.
+        :param retries: Number of times a failing batch is retried before it is split.
+        :param retry_delay: Seconds waited before the first retry, doubled for every following one.
+        """
+        if flush_size < 1:
+            raise ValueError("Flush size needs to be at least 1.")
+
+        if retries < 0:
+            raise ValueError("Retries need to be a non negative integer.")
+
+        self.flush_callback = flush_callback
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        if self._task is not None:
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def qsize(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def put(self, item):
+        if self._task is None:
+            raise RuntimeError("Queue needs to be started before items are put.")
+
+        await self._queue.put(item)
+
+    async def close(self):
+        """
+        Stops the queue once every item queued before the call has been flushed.
+        """
+        if self._task is None:
+            return
+
+        await self._queue.put(_STOP)
+        await self._task
+
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.flush_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+                if item is _STOP:
+                    stopping = True
+                    break
+
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                await self.flush_callback(batch)
+                return
+            except Exception:
+                if attempt == self.retries:
+                    log.exception("Failed to flush a batch of %d items.", len(batch))
+                else:
+                    log.warning("Failed to flush a batch of %d items, retrying.", len(batch), exc_info=True)
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+        if len(batch) > 1:
+            await self._flush_split(batch)
+        else:
+            log.error("Dropped an item that failed to flush.")
+
+    async def _flush_split(self, batch):
+        # the batch failed with every retry, its halves are flushed once each to isolate the failing items
+        middle = len(batch) // 2
+
+        for half in [batch[:middle], batch[middle:]]:
+            try:
+                await self.flush_callback(half)
+            except Exception:
+                if len(half) > 1:
+                    await self._flush_split(half)
+                else:
+                    log.exception("Dropped an item that failed to flush.")
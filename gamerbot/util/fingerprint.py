@@ -5,6 +5,8 @@
 # Author: Matt Struble
 # Date: Feb. 22 2020
 
+from bisect import bisect_left
+
 import numpy as np
 
 def template_match_hashes(template_hashes, source_hashes, match_percent=0.6):
@@ -32,47 +34,173 @@ def template_match_hashes(template_hashes, source_hashes, match_percent=0.6):
     :param match_percent: Percent of acceptance for template to match.
     :return: Array of ranges that match the provided template in the source.
     """
-    # Store staring indexes for each template hash
-    template_locs = {}
-    for t_hash in template_hashes:
-        template_locs[t_hash] = np.where(np.array(source_hashes) == t_hash)[0]
-
-    checked_idxs = []
-    matched_ranges = []
-    template_len = len(template_hashes)
-    for i in range(int(template_len/4)): # only first fourth of template can "start" the template
-        start_idxs = template_locs[template_hashes[i]]
-        for start_idx in start_idxs: # Try to find a template match for each starting index
-            if start_idx in checked_idxs:
-                continue # don't recount already counted starts
-
-            matched = 0
-            counted = 0
-            template_idx = i
-            # Look for matching hashes starting from the start index, extend search range to allow for filler values
-            for j in range(start_idx, min(len(source_hashes), start_idx + int(template_len * 1.8))):
+    template = _CompiledTemplate(template_hashes)
+
+    return template.match(np.asarray(source_hashes), match_percent)
+
+
+class _CompiledTemplate(object):
+    """
+    Template hashes with everything that doesn't depend on the source precomputed, so a template can be matched against
+    many sources.
+    """
+    def __init__(self, template_hashes):
+        self.hashes = list(template_hashes)
+        self.length = len(self.hashes)
+
+        self.start_count = int(self.length/4) # only first fourth of template can "start" the template
+        self.start_hashes = np.array(self.hashes[:self.start_count])
+
+        # Store every template index for each template hash, used to progress through the template
+        self.positions = {}
+        for t_idx, t_hash in enumerate(self.hashes):
+            self.positions.setdefault(t_hash, []).append(t_idx)
+
+        unique_hashes = np.array(list(self.positions.keys()))
+        unique_last = np.array([positions[-1] for positions in self.positions.values()])
+        order = np.argsort(unique_hashes, kind='stable')
+        self.sorted_hashes = unique_hashes[order]
+        self.sorted_last = unique_last[order]
+
+    def match(self, source, match_percent=0.6):
+        source_len = len(source)
+
+        if self.start_count == 0 or source_len == 0:
+            return []
+
+        source_list = source.tolist()
+
+        # For every source index store the last template index its hash appears at, -1 when it isn't in the template.
+        # A source hash can only progress the template from template_idx if its last template index is >= template_idx.
+        lookup = np.minimum(np.searchsorted(self.sorted_hashes, source), len(self.sorted_hashes) - 1)
+        found = self.sorted_hashes[lookup] == source
+        source_last = np.where(found, self.sorted_last[lookup], -1)
+        source_last_list = source_last.tolist()
+
+        is_template_end = source == self.hashes[-1]
+
+        checked = np.zeros(source_len, dtype=bool)
+        matched_ranges = []
+        for i in range(self.start_count):
+            is_template_start = source == self.hashes[i]
+            start_idxs = np.flatnonzero(is_template_start).tolist()
+
+            # early break for hitting end of template, or hitting another of the same start
+            break_idxs = np.flatnonzero(is_template_end | is_template_start)
+
+            for start_idx in start_idxs: # Try to find a template match for each starting index
+                if checked[start_idx]:
+                    continue # don't recount already counted starts
+
+                # Look for matching hashes starting from the start index, extend search range to allow for filler values
+                end_idx = min(source_len, start_idx + int(self.length * 1.8))
+
+                if is_template_end[start_idx]:
+                    stop_idx = start_idx
+                    hit_break = True
+                else:
+                    next_break = np.searchsorted(break_idxs, start_idx + 1)
+                    hit_break = next_break < len(break_idxs) and break_idxs[next_break] < end_idx
+                    stop_idx = int(break_idxs[next_break]) if hit_break else end_idx - 1
+
                 # only match if not already seen and only if comes after the current value in the template
-                if source_hashes[j] in template_hashes[template_idx:] and j not in checked_idxs:
-                    # update template index to force progression through the template instead of allowing multiple loops
-                    template_idx = template_hashes.index(source_hashes[j], template_idx, len(template_hashes))
-                    matched += 1
+                window = slice(start_idx, stop_idx + 1)
+                candidates = np.flatnonzero((source_last[window] >= i) & ~checked[window]) + start_idx
+
+                matched = 0
+                template_idx = i
+                for j in candidates.tolist():
+                    if source_last_list[j] >= template_idx:
+                        # update template index to force progression through the template instead of allowing multiple loops
+                        positions = self.positions[source_list[j]]
+                        template_idx = positions[bisect_left(positions, template_idx)]
+                        matched += 1
 
-                counted += 1
+                counted = stop_idx - start_idx + 1
 
-                if source_hashes[j] == template_hashes[-1] or (source_hashes[j] == template_hashes[i] and j != start_idx):
-                    break # early break for hitting end of template, or hitting another of the same start
+                # the hash that triggered an early break is left unchecked so it can start its own match
+                checked[start_idx:stop_idx] = True
+                if not hit_break:
+                    checked[stop_idx] = True
 
-                checked_idxs.append(j)
+                # only record if both the percent matched and number of counted is greater than match_percent.
+                if matched / counted >= match_percent and counted >= self.length:
+                    matched_ranges.append(range(start_idx, stop_idx+1))
 
-            # only record if both the percent matched and number of counted is greater than match_percent.
-            if matched / counted >= match_percent and counted >= template_len:
-                matched_ranges.append(range(start_idx, j+1))
+        return matched_ranges
 
-    return matched_ranges
+
+def fingerprints_to_hashes(fingerprints):
+    return [y[0] for y in sorted(fingerprints, key= lambda x: x[1])]
 
 
 def template_match_fingerprints(template_fingerprints, source_fingerprints, match_percent=0.6):
-    template_hashes = [y[0] for y in sorted(template_fingerprints, key= lambda x: x[1])]
-    source_hashes = [y[0] for y in sorted(source_fingerprints, key= lambda x: x[1])]
+    template_hashes = fingerprints_to_hashes(template_fingerprints)
+    source_hashes = fingerprints_to_hashes(source_fingerprints)
 
     return template_match_hashes(template_hashes, source_hashes, match_percent)
+
+
+def pack_fingerprints(fingerprints_list):
+    """
+    Packs the fingerprints of many sources into a single flat array of position ordered hashes, and an offsets array
+    where source i occupies hashes[offsets[i]:offsets[i+1]].
+
+    i.e:
+    fingerprints_list = [[(808, 1), (171, 0)], [], [(2938, 0)]]
+    return = (array([171, 808, 2938]), array([0, 2, 2, 3]))
+
+    :param fingerprints_list: Array of fingerprint arrays, one per source.
+    :return: Tuple of the flat hash array and the offsets array.
+    """
+    offsets = np.zeros(len(fingerprints_list) + 1, dtype=np.int64)
+    hashes = []
+
+    for i, fingerprints in enumerate(fingerprints_list):
+        hashes.extend(fingerprints_to_hashes(fingerprints))
+        offsets[i + 1] = len(hashes)
+
+    return np.array(hashes, dtype=np.int64), offsets
+
+
+def template_match_hashes_batch(templates_hashes, hashes, offsets, match_percent=0.6):
+    """
+    Counts the matches of every template in every packed source, see pack_fingerprints for the source layout.
+
+    Templates are compiled once per batch, and sources that contain none of a template's starting hashes are
+    discarded with a single vectorized pass over the packed hashes, so only candidate source/template pairs are
+    searched.
+
+    :param templates_hashes: Array of template hash arrays.
+    :param hashes: Flat array of the hashes of every source.
+    :param offsets: Array of len(sources) + 1 offsets into hashes.
+    :param match_percent: Percent of acceptance for template to match.
+    :return: Array of shape (len(sources), len(templates)) holding the number of template matches per source.
+    """
+    hashes = np.asarray(hashes)
+    offsets = np.asarray(offsets)
+
+    source_count = len(offsets) - 1
+    counts = np.zeros((source_count, len(templates_hashes)), dtype=np.int64)
+
+    if source_count == 0 or len(hashes) == 0:
+        return counts
+
+    # reduceat needs in bounds indices, empty sources are masked out afterwards
+    non_empty = offsets[1:] > offsets[:-1]
+    reduce_offsets = np.minimum(offsets[:-1], len(hashes) - 1)
+
+    for t_idx, template_hashes in enumerate(templates_hashes):
+        template = _CompiledTemplate(template_hashes)
+
+        if template.start_count == 0:
+            continue
+
+        has_start = np.isin(hashes, template.start_hashes).astype(np.int64)
+        candidates = np.flatnonzero((np.add.reduceat(has_start, reduce_offsets) > 0) & non_empty)
+
+        for s_idx in candidates.tolist():
+            source = hashes[offsets[s_idx]:offsets[s_idx + 1]]
+            counts[s_idx, t_idx] = len(template.match(source, match_percent))
+
+    return counts
@@ -0,0 +1,66 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Size bounded, thread safe mapping evicting the least recently used keys. Safe to share between the event loop and
+    the database executor threads.
+
+    i.e:
+    cache = LRUCache(max_size=100000)
+    cache.update({digest: content_id})
+    content_id = cache.get(digest)
+    """
+    def __init__(self, max_size=10000):
+        """
+        :param max_size: Maximum number of cached keys, 0 disables caching.
+        """
+        self.max_size = max_size
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        self.update({key: value})
+
+    def update(self, mapping):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,118 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+from .aho_corasick import MultiPatternCounter
+from .fingerprint import fingerprints_to_hashes, pack_fingerprints, template_match_fingerprints, \
+    template_match_hashes_batch
+
+
+class PhraseMatcher(object):
+    """
+    Immutable, pre-compiled view of the tracked phrases.
+
+    Everything that only depends on the phrases (splitting, fingerprinter construction, template fingerprints) is done
+    once when the matcher is built, so matching a message only costs work proportional to the message content. Build a
+    new matcher and swap the reference whenever the phrases change instead of mutating an existing one.
+    """
+    def __init__(self, phrase_dict, fingerprint, match_percent=0.6):
+        """
+        :param phrase_dict: Dictionary of phrase_id:phrase to match against.
+        :param fingerprint: Fingerprint factory used to build a fingerprinter for each multi word phrase.
+        :param match_percent: Percent of acceptance for a template to match.
+        """
+        self.match_percent = match_percent
+        single_word_phrases = {}
+
+        # fingerprinters are grouped so content is only fingerprinted once per distinct fingerprinter
+        self.template_groups = {}
+
+        for phrase_id, phrase in phrase_dict.items():
+            phrase = phrase.lower()
+
+            # single word phrases look for a direct match
+            if len(phrase.split(" ")) == 1:
+                single_word_phrases[phrase_id] = phrase
+                continue
+
+            try:
+                fingerprinter = fingerprint.get_fingerprinter_from_string(phrase)
+                template_fingerprints = fingerprinter.generate(phrase)
+            except:
+                continue
+
+            if len(template_fingerprints) == 0:
+                continue
+
+            group = self.template_groups.setdefault(id(fingerprinter), (fingerprinter, []))
+            group[1].append((phrase_id, template_fingerprints))
+
+        # single word phrases are all counted in one pass over the content
+        self.single_word_counter = MultiPatternCounter(single_word_phrases)
+
+    def __len__(self):
+        return len(self.single_word_counter) + sum(len(templates) for _, templates in self.template_groups.values())
+
+    def match(self, content):
+        """
+        Counts the tracked phrases in the provided message content.
+
+        :param content: Message content to search.
+        :return: Dictionary of phrase_id:count for every phrase with at least one match.
+        """
+        content = content.lower()
+
+        matched = self.single_word_counter.count(content)
+
+        for fingerprinter, templates in self.template_groups.values():
+            try:
+                content_fingerprints = fingerprinter.generate(content)
+            except:
+                continue
+
+            if len(content_fingerprints) == 0:
+                continue
+
+            for phrase_id, template_fingerprints in templates:
+                try:
+                    template_matches = template_match_fingerprints(template_fingerprints, content_fingerprints, self.match_percent)
+                except:
+                    continue
+
+                if len(template_matches) > 0:
+                    matched[phrase_id] = len(template_matches)
+
+        return matched
+
+    def match_many(self, contents):
+        """
+        Counts the tracked phrases in many message contents at once, batching the template matching of every
+        fingerprinter group across all of the messages.
+
+        :param contents: Array of message contents to search.
+        :return: Array of phrase_id:count dictionaries, one per content in the same order.
+        """
+        contents = [content.lower() for content in contents]
+
+        matched = [self.single_word_counter.count(content) for content in contents]
+
+        for fingerprinter, templates in self.template_groups.values():
+            content_fingerprints = []
+            for content in contents:
+                try:
+                    content_fingerprints.append(fingerprinter.generate(content))
+                except:
+                    content_fingerprints.append([])
+
+            hashes, offsets = pack_fingerprints(content_fingerprints)
+            templates_hashes = [fingerprints_to_hashes(template_fingerprints) for _, template_fingerprints in templates]
+
+            counts = template_match_hashes_batch(templates_hashes, hashes, offsets, self.match_percent)
+
+            for content_idx, template_idx in zip(*counts.nonzero()):
+                matched[content_idx][templates[template_idx][0]] = int(counts[content_idx, template_idx])
+
+        return matched
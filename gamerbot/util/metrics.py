@@ -0,0 +1,266 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import asyncio
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if len(names) == 0:
+        return ""
+
+    return "{" + ",".join("{}=\"{}\"".format(name, _escape(value)) for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _NoopTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class _Metric(object):
+    type = "untyped"
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+        self._lock = threading.Lock()
+
+    def _validate_labels(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError("Metric ['{}'] expects labels {} but got {}.".format(self.name, self.label_names, labels))
+
+    def render(self):
+        return "# HELP {0} {1}\n# TYPE {0} {2}\n".format(self.name, self.help, self.type) + "".join(self._render_samples())
+
+    def _render_samples(self):
+        return []
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, registry, name, help, labels=()):
+        super().__init__(registry, name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, labels=()):
+        if not self.registry.enabled:
+            return
+
+        self._validate_labels(labels)
+
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _render_samples(self):
+        with self._lock:
+            values = list(self._values.items())
+
+        return ["{}{} {}\n".format(self.name, _format_labels(self.label_names, labels), _format_value(value))
+                for labels, value in values]
+
+
+class Gauge(_Metric):
+    """
+    Gauge read from callback when rendered, i.e. a queue's current depth.
+    """
+    type = "gauge"
+
+    def __init__(self, registry, name, help, callback):
+        super().__init__(registry, name, help)
+        self.callback = callback
+
+    def _render_samples(self):
+        return ["{} {}\n".format(self.name, _format_value(self.callback()))]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {} # labels: [bucket counts, sum, count]
+
+    def observe(self, value, labels=()):
+        if not self.registry.enabled:
+            return
+
+        self._validate_labels(labels)
+
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = [[0] * len(self.buckets), 0.0, 0]
+                self._values[labels] = values
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[0][i] += 1
+                    break
+
+            values[1] += value
+            values[2] += 1
+
+    def time(self, labels=()):
+        """
+        Context manager observing the seconds spent in its block.
+        """
+        if not self.registry.enabled:
+            return _NOOP_TIMER
+
+        return _Timer(self, labels)
+
+    def _render_samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+
+        samples = []
+        bucket_label_names = self.label_names + ("le",)
+
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append("{}_bucket{} {}\n".format(self.name, _format_labels(bucket_label_names, labels + (_format_value(bound),)),
+                                                        cumulative))
+
+            label_str = _format_labels(self.label_names, labels)
+            samples.append("{}_sum{} {}\n".format(self.name, label_str, _format_value(total)))
+            samples.append("{}_count{} {}\n".format(self.name, label_str, count))
+
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    Collection of metrics rendered together in the Prometheus text format. While disabled, observing a metric returns
+    right away without touching any state, and timers are a shared no-op context manager.
+
+    i.e:
+    metrics = MetricsRegistry(enabled=True)
+    stage_seconds = metrics.histogram("gamerbot_stage_seconds", "Seconds spent per stage.", ["stage"])
+    with stage_seconds.time(("match",)):
+        ...
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, callback):
+        return self._register(Gauge(self, name, help, callback))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def render(self):
+        return "".join(metric.render() for metric in self._metrics)
+
+    def _register(self, metric):
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError("Metric ['{}'] is already registered.".format(metric.name))
+
+        self._metrics.append(metric)
+        return metric
+
+
+class MetricsServer(object):
+    """
+    Minimal HTTP server exposing a registry on GET /metrics.
+    """
+    def __init__(self, registry, host="127.0.0.1", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+
+        self._server = None
+
+    async def start(self):
+        if self._server is not None:
+            return
+
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        log.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def close(self):
+        if self._server is None:
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+
+            # headers are read and ignored
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split(" ")
+
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self.registry.render().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+
+            writer.write("HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {}\r\n"
+                         "Connection: close\r\n\r\n".format(status, len(body)).encode("latin-1") + body)
+            await writer.drain()
+        except Exception:
+            log.exception("Failed to serve a metrics request.")
+        finally:
+            writer.close()
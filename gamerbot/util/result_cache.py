@@ -0,0 +1,127 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class ResultCache(object):
+    """
+    Size bounded LRU cache of computed results with a time to live, invalidated by tag, that coalesces concurrent
+    computations of the same key.
+
+    i.e:
+    cache = ResultCache(max_size=256, ttl=30)
+    message = await cache.get_or_compute(("guild", guild_id, ""), [("guild", guild_id)], compute_guild_stats)
+    cache.invalidate([("guild", guild_id)])
+    """
+    def __init__(self, max_size=256, ttl=30):
+        """
+        :param max_size: Maximum number of cached results, 0 disables caching while still coalescing computations.
+        :param ttl: Seconds a result stays valid.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict() # key: (expires, value, tags)
+        self._tags = {} # tag: set of keys
+        self._pending = {} # key: (future of the running computation, tags)
+        self._stale = set() # pending keys invalidated while computing
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_compute(self, key, tags, compute):
+        """
+        Returns the cached result for key, or computes it with compute. Callers asking for a key that is already being
+        computed wait for that computation instead of starting their own.
+
+        :param key: Hashable key of the result.
+        :param tags: Tags the result depends on, see invalidate.
+        :param compute: Coroutine function returning the result.
+        :return: The cached or computed result.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+
+            self._remove(key)
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending[0])
+
+        future = asyncio.get_event_loop().create_future()
+        self._pending[key] = (future, tuple(tags))
+
+        try:
+            value = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # mark retrieved, waiters re-raise it themselves
+            raise
+        else:
+            future.set_result(value)
+
+            if key not in self._stale:
+                self._store(key, value, tags)
+
+            return value
+        finally:
+            if not future.done(): # the computation itself was cancelled
+                future.cancel()
+
+            del self._pending[key]
+            self._stale.discard(key)
+
+    def invalidate(self, tags):
+        """
+        Drops every result depending on any of the tags, including results still being computed.
+        """
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                self._remove(key)
+
+        # a computation that started before the invalidation may have read the old data, don't cache it
+        if len(self._pending) > 0:
+            tags = set(tags)
+            for key, (_, pending_tags) in self._pending.items():
+                if not tags.isdisjoint(pending_tags):
+                    self._stale.add(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+        self._stale.update(self._pending.keys())
+
+    def _store(self, key, value, tags):
+        if self.max_size <= 0:
+            return
+
+        self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self._tags[tag]
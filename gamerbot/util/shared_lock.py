@@ -0,0 +1,100 @@
+# Copyright (c) 2026 Matt Struble. All Rights Reserved.
+#
+# Use is subject to license terms.
+#
+# Author: Matt Struble
+# Date: Oct. 18 2026
+
+import asyncio
+
+
+class SharedLock(object):
+    """
+    Asyncio lock held either shared, by any number of holders at once, or exclusively by a single holder. A waiting
+    exclusive acquire holds back new shared acquires, so a steady stream of shared holders can't starve it.
+
+    i.e:
+    lock = SharedLock()
+    async with lock.shared():
+        ...  # runs alongside the other shared holders
+    async with lock.exclusive():
+        ...  # runs alone
+    """
+    def __init__(self):
+        self._condition = None
+        self._shared = 0 # number of shared holders
+        self._exclusive = False
+        self._waiting_exclusive = 0
+
+    def shared(self):
+        return _SharedHold(self)
+
+    def exclusive(self):
+        return _ExclusiveHold(self)
+
+    def _get_condition(self):
+        # created lazily so the condition binds to the loop the bot is actually running on
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        return self._condition
+
+    async def _acquire_shared(self):
+        condition = self._get_condition()
+
+        async with condition:
+            await condition.wait_for(lambda: not self._exclusive and self._waiting_exclusive == 0)
+            self._shared += 1
+
+    async def _release_shared(self):
+        condition = self._get_condition()
+
+        async with condition:
+            self._shared -= 1
+            if self._shared == 0:
+                condition.notify_all()
+
+    async def _acquire_exclusive(self):
+        condition = self._get_condition()
+
+        async with condition:
+            self._waiting_exclusive += 1
+            try:
+                await condition.wait_for(lambda: not self._exclusive and self._shared == 0)
+            except:
+                # a cancelled exclusive acquire no longer holds back the shared waiters
+                self._waiting_exclusive -= 1
+                condition.notify_all()
+                raise
+
+            self._waiting_exclusive -= 1
+            self._exclusive = True
+
+    async def _release_exclusive(self):
+        condition = self._get_condition()
+
+        async with condition:
+            self._exclusive = False
+            condition.notify_all()
+
+
+class _SharedHold(object):
+    def __init__(self, lock):
+        self.lock = lock
+
+    async def __aenter__(self):
+        await self.lock._acquire_shared()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.lock._release_shared()
+
+
+class _ExclusiveHold(object):
+    def __init__(self, lock):
+        self.lock = lock
+
+    async def __aenter__(self):
+        await self.lock._acquire_exclusive()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.lock._release_exclusive()
@@ -1,27 +1,38 @@
 import configparser
+import logging
 
-import psycopg2
-
+from gamerbot.database import DatabasePool
 from gamerbot.gamerbot import GamerBot
 
-config = configparser.ConfigParser()
-config.read('gamerbot.cfg')
 
-try:
-    connection = psycopg2.connect(user=config.get("PostgreSQL", "db_user"),
-                                  password=config.get("PostgreSQL", "db_password"),
-                                  host=config.get("PostgreSQL", "host"),
-                                  port=config.get("PostgreSQL", "port"),
-                                  database=config.get("PostgreSQL", "database"))
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    config = configparser.ConfigParser()
+    config.read('gamerbot.cfg')
+
+    try:
+        db_pool = DatabasePool(config.getint("PostgreSQL", "pool_min_size", fallback=1),
+                               config.getint("PostgreSQL", "pool_max_size", fallback=10),
+                               user=config.get("PostgreSQL", "db_user"),
+                               password=config.get("PostgreSQL", "db_password"),
+                               host=config.get("PostgreSQL", "host"),
+                               port=config.get("PostgreSQL", "port"),
+                               database=config.get("PostgreSQL", "database"))
+
+        phrases = config.get("Gamerbot", "phrases").split(',')
+
+        token = config.get("Discord", "token")
 
-    phrases = config.get("Gamerbot", "phrases").split(',')
+        bot = GamerBot(db_pool, phrases, config)
 
-    token = config.get("Discord", "token")
+        bot.run(token)
 
-    bot = GamerBot(connection, phrases)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
 
-    bot.run(token)
 
-except Exception as e:
-    import traceback
-    traceback.print_exc()
+# recount workers are spawned processes that import this module, only the parent starts the bot
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+-- Baseline schema, version 1 of gamerbot/database/migrations.py. The bot applies it, and every later migration, at
+-- startup. Schema changes go into a new migration, this file stays as is.
+
 CREATE TABLE "phrases" (
 	"id" serial NOT NULL,
 	"phrase" varchar(2000) NOT NULL UNIQUE,